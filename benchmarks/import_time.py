@@ -0,0 +1,100 @@
+# /usr/bin/env python3
+
+"""
+Import time budget for the omfg package and its command-line tools.
+
+Each module is imported in a fresh interpreter with python -X importtime,
+and the run fails if its cumulative import time goes over budget or if it
+pulls in a heavy dependency it should only load on demand.  Run it from
+the repository root:
+
+    python benchmarks/import_time.py [--repeat 5] [--scale 1.0]
+"""
+
+from argparse import ArgumentParser
+import subprocess
+import sys
+
+# module: (budget in milliseconds, packages it must not import)
+BUDGETS = {
+    "omfg": (20, ("numpy", "matplotlib", "cartopy", "netCDF4", "py3odb")),
+    "omfg.constants": (30, ("numpy", "matplotlib", "cartopy", "netCDF4", "py3odb")),
+    "omfg.cli.client": (30, ("numpy", "matplotlib", "cartopy", "netCDF4", "py3odb")),
+    "omfg.cli.generator": (80, ("numpy", "matplotlib", "cartopy", "netCDF4", "py3odb")),
+    "omfg.cli.server": (80, ("numpy", "matplotlib", "cartopy", "netCDF4", "py3odb")),
+    "omfg.chart": (30, ("numpy", "matplotlib", "cartopy", "netCDF4", "py3odb")),
+    "omfg.store": (400, ("matplotlib", "cartopy", "netCDF4", "py3odb")),
+    "omfg.wrappers": (400, ("matplotlib", "cartopy", "netCDF4", "py3odb")),
+    "omfg.cli.ingest": (400, ("matplotlib", "cartopy", "netCDF4", "py3odb")),
+    "omfg.chart.timeseries": (2000, ("cartopy", "netCDF4", "py3odb"))
+}
+
+
+def get_args():
+    """Get the command-line arguments"""
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Import each module this many times and keep the fastest"
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Multiply every budget, for slow machines"
+    )
+    return parser.parse_args()
+
+
+def measure(module):
+    """Import a module in a fresh interpreter, returning (milliseconds, imported modules)"""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True
+    )
+    cumulative = None
+    imported = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        name = name.strip()
+        if cumulative_us.strip().isdigit():
+            imported.add(name.split(".")[0])
+            if name == module:
+                cumulative = int(cumulative_us) / 1000
+    return cumulative, imported
+
+
+def main():
+    """Main program"""
+    args = get_args()
+    failures = 0
+    print(f"{'module':25}{'ms':>10}{'budget':>10}  result")
+    for module, (budget, forbidden) in BUDGETS.items():
+        timings = []
+        for _ in range(args.repeat):
+            milliseconds, imported = measure(module)
+            timings.append(milliseconds)
+        milliseconds = min(timings)
+        budget *= args.scale
+        problems = []
+        if milliseconds > budget:
+            problems.append("over budget")
+        loaded = sorted(imported.intersection(forbidden))
+        if loaded:
+            problems.append(f"imports {', '.join(loaded)}")
+        failures += bool(problems)
+        print(f"{module:25}{milliseconds:>10.1f}{budget:>10.0f}  {'; '.join(problems) or 'OK'}")
+    if failures:
+        print(f"{failures} of {len(BUDGETS)} modules failed their import budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
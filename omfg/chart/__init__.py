@@ -1,7 +1,32 @@
 """Module for generating charts"""
 
-from .planview import Planview
+import importlib
+import sys
+
+# chart classes are imported on first use, so each chart type only loads
+# its own plotting stack
+_CHART_MODULES = {
+    "ChartSet": ".chartset",
+    "Planview": ".planview",
+    "Timeseries": ".timeseries"
+}
 
 __all__ = [
-    "Planview"
+    "ChartSet",
+    "Planview",
+    "Timeseries"
 ]
+
+
+def __getattr__(name):
+    """Import a chart class the first time it is used"""
+    if name not in _CHART_MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_CHART_MODULES[name], __name__), name)
+
+
+if sys.version_info < (3, 7):
+    # module __getattr__ needs python 3.7
+    from .chartset import ChartSet
+    from .planview import Planview
+    from .timeseries import Timeseries
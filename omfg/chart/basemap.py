@@ -0,0 +1,178 @@
+"""Cached pre-rendered map layers for map based charts"""
+
+from hashlib import sha256
+from math import ceil, floor
+from pathlib import Path
+import json
+import logging
+import threading
+import matplotlib as mpl
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
+import cartopy
+from cartopy.feature import BORDERS, COASTLINE, ShapelyFeature
+import cartopy.crs as ccrs
+from omfg.util import atomic_open
+from .geometry import GEOMETRY_VERSION, GLOBAL_EXTENT, load_geometry
+
+# bump this whenever the look of the map layer changes
+BASEMAP_VERSION = 2
+CARTOPY_DATA_DIR = Path(__file__).parent / "cartopy"
+
+_MEMORY_CACHE = {}
+_MEMORY_CACHE_LOCK = threading.Lock()
+
+
+class BaseLayer:
+    """
+    The static part of a map (coastlines, borders, gridlines, labels and
+    outline) rendered once on a transparent background.  The image covers
+    the map axes plus their labels, snapped out to whole pixels, and
+    position is that area in figure coordinates, so it can be laid over a
+    chart's map axes without resampling.  bbox is the unsnapped area, which
+    is what a tight savefig has to include.
+
+    The layer is not pixel-identical to drawing the features on the chart:
+    a tight savefig crops at a fraction of a pixel, which shifts the live
+    artists but not the snapped image, so antialiased edges and labels can
+    differ by up to half a pixel.  Charts that need the exact output set
+    basemap_cache to false.
+    """
+    def __init__(self, image, position, bbox):
+        self.image = image
+        self.position = position
+        self.bbox = bbox
+
+    def draw(self, figure):
+        """Lay the layer over a figure, above any axes created before it"""
+        # the axes cover exactly the map and labels, so a tight savefig crops
+        # as before, and the snapped image spills over their edges unclipped
+        x_0, y_0, width, height = self.bbox
+        layer_ax = figure.add_axes(self.bbox)
+        layer_ax.set_axis_off()
+        x_min, y_min, image_width, image_height = self.position
+        layer_image = layer_ax.imshow(
+            self.image,
+            aspect="auto",
+            interpolation="none",
+            extent=(x_min, x_min + image_width, y_min, y_min + image_height)
+        )
+        layer_image.set_clip_on(False)
+        layer_image.set_in_layout(False)
+        layer_ax.set_xlim(x_0, x_0 + width)
+        layer_ax.set_ylim(y_0, y_0 + height)
+        return layer_ax
+
+
+def get_base_layer(omfg_path, figsize, dpi, map_rect):
+    """
+    Get the base layer for a global PlateCarree map, from memory, then
+    from the disk cache under omfg_path/basemap, rendering it if needed
+    """
+    key = _get_key(figsize, dpi, map_rect)
+    # charts rendering on other threads wait for the layer rather than render it again
+    with _MEMORY_CACHE_LOCK:
+        if key not in _MEMORY_CACHE:
+            _MEMORY_CACHE[key] = _load_base_layer(omfg_path, key, figsize, dpi, map_rect)
+        return _MEMORY_CACHE[key]
+
+
+def use_packaged_data():
+    """Point cartopy at the Natural Earth data shipped with omfg"""
+    data_dir = str(CARTOPY_DATA_DIR)
+    if cartopy.config["data_dir"] != data_dir:
+        logging.info("Telling cartopy to use data directory: %s", data_dir)
+        cartopy.config["data_dir"] = data_dir
+
+
+def add_map_features(map_ax, regional=False, extent=GLOBAL_EXTENT):
+    """
+    Draw the static map features onto a map axis, from the packaged
+    geometry clipped to extent (a region name, or global) when it has been
+    built, or else from the packaged shapefiles
+    """
+    # only these scales are packaged, and the automatic scale of a zoomed
+    # map would make cartopy download the finer ones
+    for layer, feature, scale in [
+            ("coastline", COASTLINE, "50m" if regional else "110m"),
+            ("borders", BORDERS, "110m")]:
+        geometries = load_geometry(layer, scale, extent)
+        if geometries is None:
+            map_ax.add_feature(feature.with_scale(scale), edgecolor="black", facecolor="none")
+        else:
+            map_ax.add_feature(
+                ShapelyFeature(geometries, ccrs.PlateCarree()), edgecolor="black", facecolor="none"
+            )
+    map_gl = map_ax.gridlines(
+        crs=ccrs.PlateCarree(),
+        draw_labels=True,
+        linewidth=1,
+        alpha=0.25,
+        color="gray"
+    )
+    # cartopy is weird about turning off the top labels
+    # which appears to have changed with 0.17
+    map_gl.xlabels_top = False  # cartopy <= 0.17
+    map_gl.top_labels = False
+
+
+def render_base_layer(figsize, dpi, map_rect):
+    """Render the map features alone and crop them to the map and its labels"""
+    figure = Figure(figsize=figsize, dpi=dpi)
+    canvas = FigureCanvasAgg(figure)
+    figure.patch.set_alpha(0)
+    map_ax = figure.add_axes(map_rect, projection=ccrs.PlateCarree())
+    map_ax.set_global()
+    # the chart's own map axis draws the background under its data
+    map_ax.patch.set_visible(False)
+    add_map_features(map_ax)
+    canvas.draw()
+    width, height = canvas.get_width_height()
+    bbox = map_ax.get_tightbbox(canvas.get_renderer())
+    x_0, y_0 = max(floor(bbox.x0), 0), max(floor(bbox.y0), 0)
+    x_1, y_1 = min(ceil(bbox.x1), width), min(ceil(bbox.y1), height)
+    # the buffer's first row is the top of the figure
+    image = np.asarray(canvas.buffer_rgba())[height - y_1:height - y_0, x_0:x_1].copy()
+    position = [x_0 / width, y_0 / height, (x_1 - x_0) / width, (y_1 - y_0) / height]
+    exact_bbox = [bbox.x0 / width, bbox.y0 / height, bbox.width / width, bbox.height / height]
+    return BaseLayer(image, position, exact_bbox)
+
+
+def _load_base_layer(omfg_path, key, figsize, dpi, map_rect):
+    """Load a base layer from the disk cache, rendering and saving it on a miss"""
+    cache_path = omfg_path / "basemap"
+    image_path = cache_path / f"{key}.npy"
+    meta_path = cache_path / f"{key}.json"
+    try:
+        with open(meta_path, "r") as fh_in:
+            meta = json.load(fh_in)
+        base_layer = BaseLayer(np.load(str(image_path)), meta["position"], meta["bbox"])
+    except (OSError, ValueError, KeyError):
+        logging.info("Rendering base map layer %s", key)
+        base_layer = render_base_layer(figsize, dpi, map_rect)
+        cache_path.mkdir(exist_ok=True)
+        with atomic_open(image_path, "wb") as fh_out:
+            np.save(fh_out, base_layer.image)
+        with atomic_open(meta_path) as fh_out:
+            json.dump({"position": base_layer.position, "bbox": base_layer.bbox}, fh_out)
+    return base_layer
+
+
+def _get_key(figsize, dpi, map_rect):
+    """Get the cache key for everything that changes how the layer looks"""
+    description = json.dumps([
+        BASEMAP_VERSION,
+        GEOMETRY_VERSION,
+        "PlateCarree",
+        "global",
+        list(figsize),
+        dpi,
+        list(map_rect),
+        mpl.__version__,
+        cartopy.__version__,
+        cartopy.config["data_dir"],
+        mpl.rcParams["font.family"],
+        mpl.rcParams["font.sans-serif"]
+    ], default=str)
+    return sha256(description.encode()).hexdigest()[:16]
@@ -0,0 +1,180 @@
+"""Content-addressed cache of rendered charts"""
+
+from contextlib import contextmanager
+from hashlib import sha256
+from pathlib import Path
+from uuid import uuid4
+import fcntl
+import json
+import logging
+import os
+import time
+from omfg.store.manifest import hash_file
+from omfg.util import atomic_open
+
+CACHE_DIRNAME = "cache"
+INDEX_FILENAME = "index.json"
+LOCK_FILENAME = ".lock"
+DEFAULT_MAX_BYTES = 1 << 30
+
+# config keys that change how a chart is looked up rather than how it looks
+_IGNORED_KEYS = ("cache",)
+
+
+class ChartCache:
+    """
+    Rendered charts stored under omfg_path/cache by a key covering the
+    normalized config, the identity (size and SHA-256, rehashed whenever
+    the mtime changes) of the input files and the code and style versions,
+    so a re-ingested cycle or a new release never serves a stale image.
+
+    An index records the size and last use of each image, and the least
+    recently used images are evicted once the total goes over max_bytes
+    (OMFG_CACHE_BYTES, or 1 GiB by default).  Images and the index are
+    written atomically and index updates hold a lock file, so several
+    processes can share the cache.  The hits and misses are kept in the
+    index, so the hit rate covers every process using the cache.
+    """
+    def __init__(self, omfg_path, max_bytes=None):
+        self._path = Path(omfg_path) / CACHE_DIRNAME
+        self._path.mkdir(exist_ok=True)
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("OMFG_CACHE_BYTES", DEFAULT_MAX_BYTES))
+        self._max_bytes = max_bytes
+        # file hashes computed outside the lock, saved with the next index update
+        self._new_files = {}
+
+    @property
+    def path(self):
+        """The Path to the cache directory"""
+        return self._path
+
+    @property
+    def max_bytes(self):
+        """The byte budget for the cached images"""
+        return self._max_bytes
+
+    @property
+    def stats(self):
+        """Get a dict of the cache's entries, bytes, hits, misses and hit rate"""
+        index = self._read_index()
+        hits, misses = index["hits"], index["misses"]
+        return {
+            "entries": len(index["entries"]),
+            "bytes": sum(entry["size"] for entry in index["entries"].values()),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0
+        }
+
+    def get_key(self, config, input_paths, version):
+        """
+        Get the key for a chart from its config, the paths of its input
+        files (directories include every file in them) and a version list
+        """
+        files = self._read_index()["files"]
+        identities = []
+        for input_path in sorted(str(path) for path in input_paths):
+            identities.extend(self._get_identities(Path(input_path), files))
+        description = json.dumps([
+            {key: str(value) for key, value in sorted(config.items()) if key not in _IGNORED_KEYS},
+            identities,
+            version
+        ])
+        return sha256(description.encode()).hexdigest()
+
+    def get_image_path(self, key):
+        """Get the Path to the cached image for a key"""
+        return self._path / f"{key}.png"
+
+    def get_render_path(self, key):
+        """Get a unique temporary Path to render an image to before it is put in the cache"""
+        return self._path / f".{key}.{uuid4().hex}.png"
+
+    def get(self, key):
+        """Get the path to the cached image for a key, or None on a miss"""
+        image_path = self.get_image_path(key)
+        with self._update_index() as index:
+            entry = index["entries"].get(key)
+            if entry is not None and not image_path.is_file():
+                del index["entries"][key]
+                entry = None
+            if entry is None:
+                index["misses"] += 1
+            else:
+                index["hits"] += 1
+                entry["used"] = time.time()
+            hits, misses = index["hits"], index["misses"]
+        logging.info(
+            "Chart cache %s, hit rate %.1f%% (%d hits, %d misses)",
+            "miss" if entry is None else "hit", 100 * hits / (hits + misses), hits, misses
+        )
+        return None if entry is None else str(image_path)
+
+    def put(self, key, render_path):
+        """
+        Move a rendered image into the cache, evicting the least recently
+        used images while the cache is over its budget, and return its path
+        """
+        image_path = self.get_image_path(key)
+        os.replace(str(render_path), str(image_path))
+        with self._update_index() as index:
+            index["entries"][key] = {"size": image_path.stat().st_size, "used": time.time()}
+            self._evict(index, key)
+            for filename in list(index["files"]):
+                if not os.path.exists(filename):
+                    del index["files"][filename]
+        return str(image_path)
+
+    def _evict(self, index, keep_key):
+        """Remove the least recently used images until the cache fits its budget"""
+        entries = index["entries"]
+        total = sum(entry["size"] for entry in entries.values())
+        for key in sorted(entries, key=lambda key: entries[key]["used"]):
+            if total <= self._max_bytes:
+                break
+            if key == keep_key:
+                continue
+            logging.info("Evicting cached chart %s", key)
+            total -= entries.pop(key)["size"]
+            image_path = self.get_image_path(key)
+            if image_path.is_file():
+                image_path.unlink()
+
+    def _get_identities(self, path, files):
+        """
+        Get the [name, size, hash] identities of a file or every file in a
+        directory, only hashing files whose size or mtime have changed
+        """
+        if path.is_dir():
+            identities = []
+            for child in sorted(path.iterdir()):
+                identities.extend(self._get_identities(child, files))
+            return identities
+        stat = path.stat()
+        filename = str(path)
+        record = self._new_files.get(filename, files.get(filename))
+        if record is None or record["size"] != stat.st_size or record["mtime_ns"] != stat.st_mtime_ns:
+            record = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": hash_file(filename)}
+            self._new_files[filename] = record
+        return [[filename, record["size"], record["hash"]]]
+
+    def _read_index(self):
+        """Read the index, or start an empty one"""
+        try:
+            with open(self._path / INDEX_FILENAME, "r") as fh_in:
+                return json.load(fh_in)
+        except (FileNotFoundError, ValueError):
+            return {"entries": {}, "files": {}, "hits": 0, "misses": 0}
+
+    @contextmanager
+    def _update_index(self):
+        """Lock, read and then atomically rewrite the index"""
+        with open(self._path / LOCK_FILENAME, "w") as fh_lock:
+            fcntl.flock(fh_lock, fcntl.LOCK_EX)
+            index = self._read_index()
+            index["files"].update(self._new_files)
+            yield index
+            with atomic_open(self._path / INDEX_FILENAME) as fh_out:
+                json.dump(index, fh_out)
+            self._new_files = {}
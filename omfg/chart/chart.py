@@ -2,18 +2,155 @@
 
 from abc import ABC, abstractmethod
 from pathlib import Path
-import matplotlib.pyplot as plt
+from uuid import uuid4
+import logging
+import os
+import matplotlib as mpl
+import numpy as np
+import omfg
+from omfg.constants import Column, Varno, VertcoType
+from omfg.formula import compile_formula
+from .cache import ChartCache
+from .pool import FigureTemplate
+
+FIGSIZE = (12, 8)
 
 
 class Chart(ABC):
-    """Abstract class for charts"""
-    def __init__(self, config):
+    """
+    Abstract class for charts.  Data that was already loaded, for example
+    by a batch rendering several charts from one file, can be passed in so
+    the chart does not load it again.  Each chart draws on its own Figure
+    with an Agg canvas and never touches pyplot's global state, so charts
+    can render on several threads at once.  Close the chart when done.
+
+    Charts with a template key can check their figure out of a FigurePool,
+    which they return it to on close, so a long-running worker reuses the
+    figures earlier charts prepared.
+    """
+    # bump this whenever a change to the code alters how the chart looks
+    STYLE_VERSION = 1
+
+    def __init__(self, config, data=None, pool=None):
         self.config = config
-        self.figure = plt.figure(figsize=(12, 8))
+        self.data = data
+        key = self.get_template_key()
+        if pool is None or key is None:
+            self.pool = None
+            self.template = FigureTemplate(key, FIGSIZE)
+        else:
+            self.pool = pool
+            self.template = pool.checkout(key, FIGSIZE)
+        self.figure = self.template.figure
 
-    @abstractmethod
     def generate(self):
-        """Generate the chart and return the absolute path to the png file."""
+        """
+        Generate the chart and return the absolute path to the png file.
+        With cache set to "true" the image comes from the chart cache when
+        the config, input files and code are unchanged.
+        """
+        mpl.rcParams["font.sans-serif"] = "Noto Mono"
+        mpl.rcParams["font.family"] = "sans-serif"
+        logging.info("Generating chart")
+        omfg_path = self.get_omfg_path()
+        if self.config.get("cache") != "true":
+            # the filename can depend on what rendering found, such as
+            # whether a planview was binned, so it is named once rendered
+            render_path = omfg_path / f".{uuid4().hex}.png"
+            try:
+                self._render(str(render_path))
+            except BaseException:
+                if render_path.exists():
+                    render_path.unlink()
+                raise
+            image_filepath = omfg_path / self.get_image_filename()
+            os.replace(str(render_path), str(image_filepath))
+            return str(image_filepath)
+        cache = ChartCache(omfg_path)
+        key = cache.get_key(self.config, self.get_input_paths(), self.get_cache_version())
+        cached_filepath = cache.get(key)
+        if cached_filepath is not None:
+            return cached_filepath
+        render_path = cache.get_render_path(key)
+        self._render(str(render_path))
+        return cache.put(key, render_path)
+
+    def close(self):
+        """Return the figure to the pool, or release it and everything drawn on it"""
+        if self.pool is not None:
+            self.pool.checkin(self.template)
+        else:
+            self.template.close()
+
+    def get_template_key(self):
+        """Get the key of the figure templates the chart can reuse, or None if it can not"""
+        return None
+
+    def _render(self, filename):
+        """Render the chart, marking its template unusable if rendering fails"""
+        try:
+            self.render(filename)
+        except BaseException:
+            self.template.usable = False
+            raise
+
+    @abstractmethod
+    def render(self, filename):
+        """Render the chart to a png file"""
+
+    @abstractmethod
+    def get_image_filename(self):
+        """Get the image filename, which is asked for after the chart has rendered"""
+
+    def apply_formula(self, varno, data):
+        """Apply the varno's formula for the chart's column to a float array in place"""
+        if varno.formula is not None:
+            if "depar" in self.config["column"]:
+                compile_formula(varno.formula["depar"])(data, out=data)
+            else:
+                compile_formula(varno.formula["value"])(data, out=data)
+        return data
+
+    def get_cache_version(self):
+        """Get the versions of everything besides the config and data that shape the image"""
+        return [omfg.__version__, type(self).__name__, self.STYLE_VERSION, mpl.__version__]
+
+    def get_input_paths(self):
+        """Get the paths of the files the chart reads, for the chart cache"""
+        return []
+
+    def apply_formula_to_stats(self, varno, means, stds, mins, maxs):
+        """
+        Transform arrays of means, stds, mins and maxs of raw values with the
+        varno's formula, treating it as affine (all of them are)
+        """
+        upper = self.apply_formula(varno, means + stds)
+        means = self.apply_formula(varno, means.copy())
+        mins = self.apply_formula(varno, mins.copy())
+        maxs = self.apply_formula(varno, maxs.copy())
+        return means, np.abs(upper - means), np.minimum(mins, maxs), np.maximum(mins, maxs)
+
+    def get_vertco_bounds(self):
+        """Get the min/max vertco reference values as numpy floating values"""
+        vertco_min, vertco_max = self.config["vertco"].split(",")
+        return np.float64(vertco_min), np.float64(vertco_max)
+
+    def get_vertco(self):
+        """Get a string representing the vertco type/range"""
+        vertco = f'{VertcoType.get_type(self.config["vertco_type"])}: '
+        vertco_min, vertco_max = self.get_vertco_bounds()
+        vertco += f'{int(vertco_min)}'
+        if vertco_min != vertco_max:
+            vertco += f' - {int(vertco_max)}'
+        return vertco
+
+    def get_desc(self):
+        """Get a string representing the varno description and column if applicable"""
+        description = Varno.get_desc(Varno.get_name(self.config["varno"]))
+        column_title = Column.get_title(self.config["column"])
+        if column_title is not None:
+            description += f" ({column_title})"
+        return description
 
     @staticmethod
     def get_omfg_path():
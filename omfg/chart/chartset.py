@@ -0,0 +1,104 @@
+"""Chart sets for rendering a planview at many vertco ranges from one data load"""
+
+import logging
+import time
+from .planview import NoObsError, Planview
+from omfg.store import CycleStore, Partition
+from omfg.store.partition import sort_by_vertco
+
+# the standard pressure levels (Pa) used by vertco_set "standard"
+STANDARD_LEVELS = [
+    100000, 92500, 85000, 70000, 50000, 40000, 30000, 25000,
+    20000, 15000, 10000, 7000, 5000, 3000, 2000, 1000
+]
+
+
+class ChartSet:
+    """
+    A set of planview charts that differ only by their vertco range.  The
+    config's vertco_set is a list of "min,max" ranges, or "standard" for
+    the standard pressure levels.  The data is loaded and sorted by vertco
+    once, and every chart is drawn on the same figure and map, with only
+    the obs, colorbar, text box and title updated between levels.  Levels
+    without obs are skipped, and any other error fails the whole set.
+    """
+    def __init__(self, config, data=None, pool=None):
+        self.config = config
+        self.data = data
+        self.pool = pool
+        self.chart = None
+
+    @property
+    def configs(self):
+        """The single-chart config of each vertco range"""
+        configs = []
+        for vertco in self.get_vertco_set():
+            config = {key: value for key, value in self.config.items() if key != "vertco_set"}
+            config["vertco"] = vertco
+            configs.append(config)
+        return configs
+
+    def get_vertco_set(self):
+        """Get the list of "min,max" vertco ranges"""
+        vertco_set = self.config["vertco_set"]
+        if vertco_set == "standard":
+            return [f"{level},{level}" for level in STANDARD_LEVELS]
+        if isinstance(vertco_set, str):
+            raise ValueError(f"Unknown vertco set: {vertco_set}")
+        return [str(vertco) for vertco in vertco_set]
+
+    def generate(self):
+        """Generate every chart and return the list of absolute paths to the png files"""
+        if self.config["chart_type"] != "planview":
+            raise ValueError("Chart sets are only available for planview charts")
+        configs = self.configs
+        if not configs:
+            raise ValueError("The vertco set is empty")
+        self.chart = chart = Planview(configs[0], self.load_data(configs), self.pool)
+        paths = []
+        times = []
+        for config in configs:
+            start_time = time.perf_counter()
+            chart.config = config
+            try:
+                paths.append(chart.generate())
+            except NoObsError as err:
+                # a level without obs should not cost the rest of the set,
+                # but any other error is a real failure of the set
+                logging.warning("Skipping vertco %s: %s", config["vertco"], err)
+                continue
+            times.append(time.perf_counter() - start_time)
+        if len(times) > 1:
+            logging.info(
+                "Rendered %d charts: %.2fs for the first, %.2fs per chart after",
+                len(times), times[0], sum(times[1:]) / (len(times) - 1)
+            )
+        if not paths:
+            raise ValueError("No charts in the vertco set could be rendered")
+        return paths
+
+    def close(self):
+        """Return or release the shared figure"""
+        if self.chart is not None:
+            self.chart.close()
+            self.chart = None
+
+    def load_data(self, configs):
+        """Load the rows of every vertco range once, sorted and indexed by vertco"""
+        if self.data is not None:
+            return self.data
+        if "odb_file" in self.config:
+            from omfg.wrappers import ODB, Query
+            logging.info("Querying the odb file for %d vertco ranges", len(configs))
+            bounds = [float(bound) for config in configs for bound in config["vertco"].split(",")]
+            config = dict(configs[0], vertco=f"{min(bounds)},{max(bounds)}")
+            odb_data = ODB(self.config["odb_file"], query=Query.from_config(config)).data
+            odb_data, index = sort_by_vertco(odb_data)
+            return Partition(odb_data, len(odb_data), index)
+        logging.info("Loading the numpy data")
+        store = CycleStore(self.config["data_path"], self.config["cycle"])
+        return store.load(
+            self.config["obs_group"],
+            self.config["varno"],
+            columns=Planview.get_columns(self.config)
+        ).to_memory()
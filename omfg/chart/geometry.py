@@ -0,0 +1,104 @@
+"""Preprocessed Natural Earth map geometry packaged with omfg"""
+
+from functools import lru_cache
+from pathlib import Path
+import logging
+import numpy as np
+import shapely
+from omfg.constants.region import REGIONS
+from omfg.util import atomic_open
+
+# bump this whenever the preprocessing changes, and rebuild with omfg-geometry
+GEOMETRY_VERSION = 1
+GEOMETRY_PATH = Path(__file__).parent / "cartopy" / "geometry.npz"
+GLOBAL_EXTENT = "global"
+
+# the Natural Earth (category, name) of each layer drawn on the maps, with the packaged scales
+LAYERS = {
+    "coastline": ("physical", "coastline", ("110m", "50m")),
+    "borders": ("cultural", "admin_0_boundary_lines_land", ("110m",))
+}
+# degrees, well under a pixel on the maps each scale is drawn for
+SIMPLIFY_TOLERANCES = {
+    "110m": 0.01,
+    "50m": 0.005
+}
+# degrees kept around a region, since a projected map shows more than its lat/lon box
+CLIP_MARGIN = 15.0
+
+
+def build_geometry(data_dir, filepath=GEOMETRY_PATH):
+    """
+    Read the layers' shapefiles from a cartopy data directory and write
+    them to one compressed numpy file.  Every scale is simplified, and
+    clipped to each named region as well as kept whole for global maps,
+    and each (layer, scale, extent) is stored as the coordinates of its
+    lines plus their offsets, which load without parsing any shapefiles.
+    """
+    from cartopy.io.shapereader import Reader
+    arrays = {"version": np.array(GEOMETRY_VERSION)}
+    for layer, (category, name, scales) in LAYERS.items():
+        for scale in scales:
+            shapefile = Path(data_dir) / "shapefiles" / "natural_earth" / category / f"ne_{scale}_{name}.shp"
+            lines = _get_lines(list(Reader(str(shapefile)).geometries()))
+            lines = shapely.simplify(lines, SIMPLIFY_TOLERANCES[scale])
+            extents = [(GLOBAL_EXTENT, None)] + sorted(REGIONS.items())
+            for extent, bbox in extents:
+                clipped = lines if bbox is None else _get_lines(shapely.intersection(lines, _get_clip_box(bbox)))
+                # float32 keeps the points to within a metre
+                coords = shapely.get_coordinates(clipped).astype(np.float32)
+                offsets = np.concatenate(([0], np.cumsum(shapely.get_num_coordinates(clipped))))
+                arrays[f"{layer}_{scale}_{extent}_coords"] = coords
+                arrays[f"{layer}_{scale}_{extent}_offsets"] = offsets.astype(np.int32)
+                logging.info("%s %s %s: %d lines, %d points", layer, scale, extent, len(clipped), len(coords))
+    with atomic_open(filepath, "wb") as fh_out:
+        np.savez_compressed(fh_out, **arrays)
+    return filepath
+
+
+@lru_cache(maxsize=None)
+def load_geometry(layer, scale, extent=GLOBAL_EXTENT):
+    """
+    Get the packaged lines of a layer at a scale, clipped to a named region
+    or whole for the global extent, as an array of shapely LineStrings.
+    Returns None if they were not built for this version or this shapely
+    can not create them, in which case cartopy reads the shapefiles.
+    """
+    if not hasattr(shapely, "linestrings"):
+        # vectorized constructors need shapely 2
+        return None
+    try:
+        with np.load(str(GEOMETRY_PATH)) as arrays:
+            if int(arrays["version"]) != GEOMETRY_VERSION:
+                return None
+            coords = arrays[f"{layer}_{scale}_{extent}_coords"]
+            offsets = arrays[f"{layer}_{scale}_{extent}_offsets"]
+    except (FileNotFoundError, KeyError):
+        return None
+    coords = coords.astype(np.float64)
+    return shapely.linestrings(coords, indices=np.repeat(np.arange(len(offsets) - 1), np.diff(offsets)))
+
+
+def _get_lines(geometries):
+    """Split geometries into their non-empty single LineStrings"""
+    parts = shapely.get_parts(np.asarray(geometries, dtype=object))
+    parts = parts[shapely.get_type_id(parts) == shapely.GeometryType.LINESTRING]
+    return parts[shapely.get_num_coordinates(parts) >= 2]
+
+
+def _get_clip_box(bbox):
+    """Get the lat/lon box (or pair of boxes across the dateline) of a region plus its margin"""
+    lat_min, lat_max, lon_min, lon_max = bbox
+    if lon_min > lon_max:
+        lon_max += 360
+    lat_min, lat_max = max(lat_min - CLIP_MARGIN, -90), min(lat_max + CLIP_MARGIN, 90)
+    lon_min, lon_max = lon_min - CLIP_MARGIN, lon_max + CLIP_MARGIN
+    if lon_max - lon_min >= 360:
+        return shapely.box(-180, lat_min, 180, lat_max)
+    if lon_min < -180:
+        lon_min += 360
+    elif lon_max > 180:
+        lon_max -= 360
+    else:
+        return shapely.box(lon_min, lat_min, lon_max, lat_max)
+    return shapely.union(shapely.box(lon_min, lat_min, 180, lat_max), shapely.box(-180, lat_min, lon_max, lat_max))
@@ -1,44 +1,137 @@
 """Plan View for generating map based charts"""
 
-from pathlib import Path
 import logging
 import matplotlib as mpl
-mpl.use("AGG")
-import matplotlib.pyplot as plt
 import numpy as np
 import cartopy
-from cartopy.feature import BORDERS
-import cartopy.crs as ccrs
-from .chart import Chart
-from omfg.constants import Column, Varno, VertcoType
+from .basemap import BASEMAP_VERSION, add_map_features, get_base_layer, use_packaged_data
+from .binning import bin_values
+from .chart import FIGSIZE, Chart
+from .geometry import GEOMETRY_VERSION, GLOBAL_EXTENT
+from .projection import (
+    DEFAULT_PROJECTION, PLATE_CARREE, get_default_bbox, get_projection, get_projection_key,
+    project_points
+)
+from omfg.constants import Region, Varno
+from omfg.store import CycleStore, Partition, in_bbox, is_exact_range, merge_stats, select_stats
+
+DPI = 150
+MAP_RECT = [0.1, 0.15, 0.8, 0.7]
+# the area a global map takes up in MAP_RECT, which keeps taller regions clear of the text box
+REGION_RECT = [0.1, 0.2, 0.8, 0.6]
+# above this many obs the chart is drawn as a grid of binned values
+DEFAULT_BIN_THRESHOLD = 500000
+DEFAULT_BIN_SIZE = 1.0
+
+
+class NoObsError(ValueError):
+    """Raised when a chart's vertco range, bbox and filters leave no obs to plot"""
 
 
 class Planview(Chart):
-    """Map-based chart"""
-    logging.info("Telling cartopy to use data directory: %s", str(Path(__file__).parent / "cartopy"))
-    cartopy.config["data_dir"] = str(Path(__file__).parent / "cartopy")
-
-    def generate(self):
-        """Generate the chart"""
-        mpl.rcParams["font.sans-serif"] = "Noto Mono"
-        mpl.rcParams["font.family"] = "sans-serif"
-        logging.info("Generating chart")
-        omfg_path = self.get_omfg_path()
-        image_filepath = omfg_path / self.get_image_filename()
-        if self.config["cache"] == "true":
-            if image_filepath.is_file():
-                return str(image_filepath)
+    """
+    Map-based chart.  A figure template an earlier planview drew on, from a
+    FigurePool or from rendering again after changing the config as a
+    ChartSet does for each vertco range, keeps its map and only has what
+    depends on the data updated.
+
+    A bbox ("lat_min,lat_max,lon_min,lon_max") or region config key limits
+    the chart to the obs in that box, read through the partition's cell
+    index, and zooms the map to it.  The projection key picks the map
+    projection (see omfg.chart.projection), and a store partition's obs are
+    projected onto it once and cached, so every chart of the partition
+    reuses the same x/y.
+    """
+
+    def render(self, filename):
+        """Render the chart"""
+        use_packaged_data()
         self.varno = Varno.get_varno_from_code(self.config["varno"])
-        lats, lons, data = self.load_data()
-        if self.varno.formula is not None:
-            if "depar" in self.config["column"]:
-                data = eval(self.varno.formula["depar"])
-            else:
-                data = eval(self.varno.formula["value"])
-        map_ax = self.setup_map_ax()
-        cmap, norm = self.setup_colors(np.min(data), np.max(data))
-        self.generate_plot(str(image_filepath), map_ax, cmap, norm, lons, lats, data)
-        return str(image_filepath)
+        self.projection = self.get_projection()
+        lats, lons, data, rows = self.load_data()
+        if len(data) == 0:
+            raise NoObsError(f"No obs to plot for {self.get_vertco()}")
+        # load_data returns a fresh array, so the formula can run in place
+        self.apply_formula(self.varno, data)
+        stats = self.get_stats(data)
+        cmap, norm = self.setup_colors(stats["min"], stats["max"])
+        self.binned = len(data) > int(self.config.get("bin_threshold", DEFAULT_BIN_THRESHOLD))
+        # a binned mesh is drawn from the lat/lons
+        self.points = None if self.binned else self.project(lons, lats, rows)
+        if not self.template.artists:
+            self.generate_plot(filename, self.setup_map_ax(), cmap, norm, lons, lats, data, stats)
+        else:
+            self.update_plot(filename, cmap, norm, lons, lats, data, stats)
+
+    def get_template_key(self):
+        """Get the key of the figure templates the chart can reuse"""
+        return (
+            self.config["chart_type"],
+            FIGSIZE,
+            self.config.get("basemap_cache", "true"),
+            self.get_bbox(),
+            self.config.get("projection", DEFAULT_PROJECTION)
+        )
+
+    def get_bbox(self):
+        """
+        Get the (lat_min, lat_max, lon_min, lon_max) box of a regional chart
+        or a projection that only shows part of the globe, or None
+        """
+        bbox = Region.get_config_bbox(self.config)
+        if bbox is None:
+            return get_default_bbox(self.config.get("projection", DEFAULT_PROJECTION))
+        return bbox
+
+    def get_map_extent(self):
+        """Get the region the packaged map geometry is clipped to, or global"""
+        region = self.config.get("region")
+        if self.config.get("bbox") is None and region is not None and Region.get_bbox(region) is not None:
+            return region.lower()
+        return GLOBAL_EXTENT
+
+    def get_projection(self):
+        """Get the map projection, centred on a regional chart's box if it crosses the dateline"""
+        bbox = self.get_bbox()
+        central_longitude = 0.0
+        if bbox is not None and bbox[2] > bbox[3]:
+            central_longitude = (bbox[2] + bbox[3] + 360) / 2
+        return get_projection(self.config.get("projection", DEFAULT_PROJECTION), central_longitude)
+
+    def project(self, lons, lats, rows):
+        """
+        Get the x/y of the obs in the map projection.  Every row of a store
+        partition is projected with one vectorized transform_points call the
+        first time a chart needs that projection, and cached in the store,
+        so the other charts of the partition only gather their rows.
+        """
+        if self.projection == PLATE_CARREE:
+            return lons, lats
+        if rows is None:
+            points = project_points(self.projection, lons, lats)
+            return points[:, 0], points[:, 1]
+        store = CycleStore(self.config["data_path"], self.config["cycle"])
+        obs_group, varno = self.config["obs_group"], self.config["varno"]
+        projection_key = get_projection_key(self.projection)
+        points = store.load_projected(obs_group, varno, projection_key)
+        if points is None or len(points) <= rows.max():
+            logging.info("Projecting the obs of %s_%s", obs_group, varno)
+            token = store.get_token(obs_group, varno)
+            partition = store.load(obs_group, varno, columns=["lat@hdr", "lon@hdr"])
+            points = project_points(self.projection, partition["lon@hdr"], partition["lat@hdr"])
+            store.write_projected(obs_group, varno, projection_key, points, token)
+        return points[rows, 0], points[rows, 1]
+
+    def get_cache_version(self):
+        """Get the versions that shape the image, including the map layer's"""
+        return super().get_cache_version() + [cartopy.__version__, BASEMAP_VERSION, GEOMETRY_VERSION]
+
+    def get_input_paths(self):
+        """Get the ODB2 file or the store partition the chart reads"""
+        if "odb_file" in self.config:
+            return [self.config["odb_file"]]
+        store = CycleStore(self.config["data_path"], self.config["cycle"])
+        return store.get_source_paths(self.config["obs_group"], self.config["varno"])
 
     def get_image_filename(self):
         """Get the image filename"""
@@ -53,27 +146,47 @@ class Planview(Chart):
             vertco_min,
             vertco_max
         ])
+        if self.config.get("bbox") is not None:
+            filestem += "_" + "_".join(str(self.config["bbox"]).split(","))
+        elif self.config.get("region") is not None:
+            filestem += f"_{self.config['region']}"
+        if self.config.get("projection", DEFAULT_PROJECTION) != DEFAULT_PROJECTION:
+            filestem += f"_{self.config['projection']}"
+        if self.binned:
+            # a binned chart differs from the scatter chart and by its grid and stat
+            bin_size = self.config.get("bin_size", DEFAULT_BIN_SIZE)
+            filestem += f"_binned_{bin_size}_{self.config.get('bin_stat', 'mean')}"
         return f"{filestem}.png"
 
-    @staticmethod
-    def setup_map_ax():
+    def setup_map_ax(self):
         """Set up the map axis"""
         logging.info("Setting up map axis")
-        map_ax = plt.axes([0.1, 0.15, 0.8, 0.7], projection=ccrs.PlateCarree())
-        map_ax.set_global()
-        map_ax.coastlines()
-        map_ax.add_feature(BORDERS)
-        map_gl = map_ax.gridlines(
-            crs=ccrs.PlateCarree(),
-            draw_labels=True,
-            linewidth=1,
-            alpha=0.25,
-            color="gray"
+        bbox = self.get_bbox()
+        map_ax = self.figure.add_axes(
+            MAP_RECT if bbox is None else REGION_RECT, projection=self.projection
         )
-        # cartopy is weird about turning off the top labels
-        # which appears to have changed with 0.17
-        map_gl.xlabels_top = False  # cartopy <= 0.17
-        map_gl.top_labels = False
+        if bbox is None:
+            map_ax.set_global()
+        else:
+            lat_min, lat_max, lon_min, lon_max = bbox
+            if lon_min > lon_max:
+                lon_max += 360
+            map_ax.set_extent([lon_min, lon_max, lat_min, lat_max], crs=PLATE_CARREE)
+        # the cached layer is of a global PlateCarree map
+        if bbox is None and self.projection == PLATE_CARREE \
+                and self.config.get("basemap_cache", "true") == "true":
+            # the static features are a cached layer drawn over the data, whose
+            # edges can sit up to half a pixel off those of an uncached chart
+            map_ax.spines["geo"].set_visible(False)
+            base_layer = get_base_layer(
+                self.get_omfg_path(),
+                tuple(self.figure.get_size_inches()),
+                DPI,
+                MAP_RECT
+            )
+            base_layer.draw(self.figure)
+        else:
+            add_map_features(map_ax, regional=bbox is not None, extent=self.get_map_extent())
         return map_ax
 
     def setup_colors(self, min_value, max_value):
@@ -81,11 +194,11 @@ class Planview(Chart):
         logging.info("Normalizing colors")
         if self.varno.cmap is not None:
             if "depar" in self.config["column"]:
-                cmap = mpl.cm.get_cmap(self.varno.cmap["depar"])
+                cmap = mpl.colormaps[self.varno.cmap["depar"]]
             else:
-                cmap = mpl.cm.get_cmap(self.varno.cmap["value"])
+                cmap = mpl.colormaps[self.varno.cmap["value"]]
         else:
-            cmap = mpl.cm.get_cmap("jet")
+            cmap = mpl.colormaps["jet"]
         # bounds = np.arange(950, 1060, 10)  # TODO: make this dynamic based on chart details
         if self.varno.levels is None:
             bounds = np.linspace(min_value, max_value, 10)
@@ -98,83 +211,210 @@ class Planview(Chart):
         return cmap, norm
 
     def load_data(self):
-        """Use numpy to load the data"""
-        data_path = Path(self.config["data_path"])
-        numpy_filepath = data_path / self.config["cycle"]
-        numpy_filepath /= f"{self.config['obs_group']}_{self.config['varno']}.npy"
-        logging.info("Loading the numpy data")
-        np_data = np.load(str(numpy_filepath))
-        logging.info("Extracting the relevant data")
+        """Use numpy to load the lats, lons and values to plot, and their rows in the partition"""
         column = self.config["column"]
+        if self.data is not None:
+            np_data = self.data
+        elif "odb_file" in self.config:
+            # ad-hoc extraction straight from an ODB2 file, only needed for this chart
+            from omfg.wrappers import ODB, Query
+            logging.info("Querying the odb file")
+            odb_data = ODB(self.config["odb_file"], query=Query.from_config(self.config)).data
+            np_data = Partition(odb_data, len(odb_data))
+        else:
+            store = CycleStore(self.config["data_path"], self.config["cycle"])
+            logging.info("Loading the numpy data")
+            np_data = store.load(
+                self.config["obs_group"],
+                self.config["varno"],
+                columns=self.get_columns(self.config)
+            )
+        logging.info("Extracting the relevant data")
+        bbox = self.get_bbox()
         vertco_min, vertco_max = self.get_vertco_bounds()
-        condition = (~np.isnan(np_data[column]))
-        condition &= (~np.isnan(np_data["vertco_reference_1@body"]))
-        condition &= (np_data["vertco_type@body"] == int(self.config["vertco_type"]))
-        condition &= (np_data["vertco_reference_1@body"] >= vertco_min)
-        condition &= (np_data["vertco_reference_1@body"] <= vertco_max)
-        indx = np.where(condition)
-        lats = np_data["lat@hdr"][indx]
-        lons = np_data["lon@hdr"][indx]
-        data = np_data[column][indx]
-        return lats, lons, data
-
-    def generate_plot(self, filename, map_ax, cmap, norm, lons, lats, data):
-        """Generate the plot"""
-        logging.info("Generating scatter plot")
-        sc_plot = map_ax.scatter(
-            lons,
-            lats,
-            c=data,
-            s=1.0,
-            # marker="o",
-            cmap=cmap,
-            norm=norm
-        )
+        rows = np_data.get_vertco_slice(self.config["vertco_type"], vertco_min, vertco_max)
+        if rows is None:
+            # unsorted partition without a vertco index
+            condition = (~np.isnan(np_data[column]))
+            condition &= (~np.isnan(np_data["vertco_reference_1@body"]))
+            condition &= (np_data["vertco_type@body"] == int(self.config["vertco_type"]))
+            condition &= (np_data["vertco_reference_1@body"] >= vertco_min)
+            condition &= (np_data["vertco_reference_1@body"] <= vertco_max)
+            if bbox is not None:
+                lats, lons = np.asarray(np_data["lat@hdr"]), np.asarray(np_data["lon@hdr"])
+                condition &= in_bbox(lats, lons, bbox)
+            indx = np.flatnonzero(condition)
+        elif bbox is None:
+            indx = np.flatnonzero(~np.isnan(np_data[column][rows])) + rows.start
+        else:
+            # only the rows of the cells overlapping the box, then the exact box
+            indx = np_data.get_bbox_rows(bbox, rows)
+            if indx is None:
+                indx = np.arange(rows.start, rows.stop)
+            indx = indx[~np.isnan(np_data[column][indx])]
+            indx = indx[in_bbox(np_data["lat@hdr"][indx], np_data["lon@hdr"][indx], bbox)]
+        # compact partitions are upcast so the formulas and stats run in float64
+        lats = np_data["lat@hdr"][indx].astype(np.float64)
+        lons = np_data["lon@hdr"][indx].astype(np.float64)
+        data = np_data[column][indx].astype(np.float64)
+        # the rows only index the store partition, not an ad-hoc odb query
+        return lats, lons, data, None if "odb_file" in self.config else indx
+
+    @staticmethod
+    def get_columns(config):
+        """Get the columns a chart reads from its partition"""
+        return ["lat@hdr", "lon@hdr", config["column"], "vertco_type@body", "vertco_reference_1@body"]
+
+    def generate_plot(self, filename, map_ax, cmap, norm, lons, lats, data, stats):
+        """Generate the plot, binned above bin_threshold obs, with exact stats in the text box"""
+        sc_plot = self.plot_data(map_ax, cmap, norm, lons, lats, data)
 
         logging.info("Adding colorbar")
-        cbar_ax = plt.axes([0.10, 0.125, 0.8, 0.025])
+        cbar_ax = self.figure.add_axes([0.10, 0.125, 0.8, 0.025])
         cbar = self.figure.colorbar(sc_plot, cax=cbar_ax, orientation="horizontal")
-        if self.varno.units is not None:
-            cbar.set_label(self.varno.units)
+        self.set_cbar_label(cbar)
         cbar.ax.tick_params(size=0)
 
         logging.info("Adding textbox")
-        text_ax = plt.axes([0.1, 0.8, 0.8, 0.05])
+        text_ax = self.figure.add_axes([0.1, 0.8, 0.8, 0.05])
         text_ax.get_xaxis().set_ticks([])
         text_ax.get_yaxis().set_ticks([])
-        text_ax.text(0.05, 0.35, f"Obs Count: {len(data)}", fontsize=10)
-        text_ax.text(0.25, 0.35, f"Max: {np.max(data):.1f}", fontsize=10)
-        text_ax.text(0.45, 0.35, f"Min: {np.min(data):.1f}", fontsize=10)
-        text_ax.text(0.65, 0.35, f"Mean: {np.mean(data):.1f}", fontsize=10)
-        text_ax.text(0.85, 0.35, f"StDev: {np.std(data):.1f}", fontsize=10)
-        text_ax.set_title(
+        text_artists = [
+            text_ax.text(position, 0.35, text, fontsize=10)
+            for position, text in zip((0.05, 0.25, 0.45, 0.65, 0.85), self.get_text(stats))
+        ]
+        title_artist = text_ax.set_title(
             self.get_title(),
             fontsize=14
         )
+        self.template.artists.update(
+            map_ax=map_ax,
+            sc_plot=sc_plot,
+            binned=self.binned,
+            cbar=cbar,
+            text_artists=text_artists,
+            title_artist=title_artist
+        )
         logging.info("Saving")
-        plt.savefig(filename, bbox_inches="tight", dpi=150, pad_inches=0.25)
+        self.figure.savefig(filename, bbox_inches="tight", dpi=DPI, pad_inches=0.25)
 
-    def get_vertco_bounds(self):
-        """Get the min/max vertco reference values as numpy floating values"""
-        vertco_min, vertco_max = self.config["vertco"].split(",")
-        return np.float(vertco_min), np.float(vertco_max)
+    def update_plot(self, filename, cmap, norm, lons, lats, data, stats):
+        """
+        Update the plot an earlier chart generated on the template for the
+        current config, only replacing the scatter offsets and colors (or
+        the binned mesh), the colorbar, the text box and the title
+        """
+        logging.info("Updating plot")
+        artists = self.template.artists
+        if self.binned or artists["binned"]:
+            artists["sc_plot"].remove()
+            artists["sc_plot"] = self.plot_data(artists["map_ax"], cmap, norm, lons, lats, data)
+            artists["binned"] = self.binned
+        else:
+            artists["sc_plot"].set_offsets(np.column_stack(self.points))
+            artists["sc_plot"].set_array(data)
+            artists["sc_plot"].set_cmap(cmap)
+            artists["sc_plot"].set_norm(norm)
+        artists["cbar"].update_normal(artists["sc_plot"])
+        self.set_cbar_label(artists["cbar"])
+        for artist, text in zip(artists["text_artists"], self.get_text(stats)):
+            artist.set_text(text)
+        artists["title_artist"].set_text(self.get_title())
+        logging.info("Saving")
+        self.figure.savefig(filename, bbox_inches="tight", dpi=DPI, pad_inches=0.25)
 
-    def get_vertco(self):
-        """Get a string representing the vertco type/range"""
-        vertco = f'{VertcoType.get_type(self.config["vertco_type"])}: '
+    def plot_data(self, map_ax, cmap, norm, lons, lats, data):
+        """Draw the obs as a scatter plot, or as a binned mesh when the plot is binned"""
+        if self.binned:
+            return self.plot_binned(map_ax, cmap, norm, lons, lats, data)
+        logging.info("Generating scatter plot")
+        x_values, y_values = self.points
+        return map_ax.scatter(
+            x_values,
+            y_values,
+            c=data,
+            s=1.0,
+            # marker="o",
+            cmap=cmap,
+            norm=norm
+        )
+
+    def set_cbar_label(self, cbar):
+        """Label the colorbar with the units, or the obs count per cell"""
+        if self.binned and self.config.get("bin_stat") == "count":
+            cbar.set_label("Obs per cell")
+        elif self.varno.units is not None:
+            cbar.set_label(self.varno.units)
+        elif cbar.ax.get_xlabel():
+            # a reused template keeps the label of the chart it was drawn for
+            cbar.set_label("")
+
+    @staticmethod
+    def get_text(stats):
+        """Get the text box entries for the stats"""
+        return [
+            f"Obs Count: {stats['count']}",
+            f"Max: {stats['max']:.1f}",
+            f"Min: {stats['min']:.1f}",
+            f"Mean: {stats['mean']:.1f}",
+            f"StDev: {stats['std']:.1f}"
+        ]
+
+    def get_stats(self, data):
+        """
+        Get the count, max, min, mean and std of the plotted values, merged
+        from the store's aggregates when they are current and cover the
+        vertco range exactly, otherwise computed from the values themselves
+        """
         vertco_min, vertco_max = self.get_vertco_bounds()
-        vertco += f'{int(vertco_min)}'
-        if vertco_min != vertco_max:
-            vertco += f' - {int(vertco_max)}'
-        return vertco
-
-    def get_desc(self):
-        """Get a string representing the varno description and column if applicable"""
-        description = Varno.get_desc(Varno.get_name(self.config["varno"]))
-        column_title = Column.get_title(self.config["column"])
-        if column_title is not None:
-            description += f" ({column_title})"
-        return description
+        vertco_type = self.config["vertco_type"]
+        # the aggregates cover the whole globe
+        if "odb_file" not in self.config and self.get_bbox() is None \
+                and is_exact_range(vertco_type, vertco_min, vertco_max):
+            store = CycleStore(self.config["data_path"], self.config["cycle"])
+            aggregates = store.load_stats(self.config["obs_group"], self.config["varno"], compute=False)
+            if aggregates is not None:
+                count, mean, std, value_min, value_max = merge_stats(select_stats(
+                    aggregates, self.config["column"], vertco_type, vertco_min, vertco_max
+                ))
+                # a partition replaced since the data was loaded would not match
+                if count == len(data) and count > 0:
+                    means, stds, mins, maxs = self.apply_formula_to_stats(
+                        self.varno, *(np.array([value]) for value in (mean, std, value_min, value_max))
+                    )
+                    return {
+                        "count": count, "max": maxs[0], "min": mins[0], "mean": means[0], "std": stds[0]
+                    }
+        return {
+            "count": len(data),
+            "max": np.max(data),
+            "min": np.min(data),
+            "mean": np.mean(data),
+            "std": np.std(data)
+        }
+
+    def plot_binned(self, map_ax, cmap, norm, lons, lats, data):
+        """
+        Draw the obs as a single mesh of values binned onto a lat/lon grid,
+        using the bin_size (degrees) and bin_stat (mean, median, count or
+        max_abs) config keys
+        """
+        bin_stat = self.config.get("bin_stat", "mean")
+        logging.info("Generating binned plot of the %s of %d obs", bin_stat, len(data))
+        lon_edges, lat_edges, grid = bin_values(
+            lats,
+            lons,
+            data,
+            self.config.get("bin_size", DEFAULT_BIN_SIZE),
+            bin_stat
+        )
+        if bin_stat == "count":
+            norm = mpl.colors.Normalize(vmin=1, vmax=max(grid.max(), 2))
+        if self.projection == PLATE_CARREE:
+            return map_ax.pcolormesh(lon_edges, lat_edges, grid, cmap=cmap, norm=norm)
+        return map_ax.pcolormesh(
+            lon_edges, lat_edges, grid, cmap=cmap, norm=norm, transform=PLATE_CARREE
+        )
 
     def get_title(self):
         """Build the title for the chart"""
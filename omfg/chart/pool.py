@@ -0,0 +1,139 @@
+"""Pool of prepared figure templates for long-running render workers"""
+
+from collections import deque
+import gc
+import logging
+import os
+import threading
+import weakref
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
+
+DEFAULT_MAX_BYTES = 256 << 20
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+class FigureTemplate:
+    """
+    A figure with an Agg canvas plus the handles to the artists a chart
+    drew on it, so the next chart of the same kind (the same key) can
+    update those artists instead of building the figure again.  A template
+    whose render failed part way is not usable and is never reused.
+    """
+    def __init__(self, key, figsize):
+        self.key = key
+        self.figure = Figure(figsize=figsize)
+        FigureCanvasAgg(self.figure)
+        self.artists = {}
+        self.usable = True
+
+    @property
+    def nbytes(self):
+        """Estimate of the memory held by the template: its Agg buffer and plotted data"""
+        renderer = getattr(self.figure.canvas, "renderer", None)
+        nbytes = 0 if renderer is None else int(renderer.width) * int(renderer.height) * 4
+        for axes in self.figure.axes:
+            for collection in axes.collections:
+                nbytes += np.asarray(collection.get_offsets()).nbytes
+                if collection.get_array() is not None:
+                    nbytes += np.asarray(collection.get_array()).nbytes
+        return nbytes
+
+    def close(self):
+        """Release the figure and everything drawn on it"""
+        self.figure.clear()
+        self.artists = {}
+
+
+class FigurePool:
+    """
+    Figure templates, keyed by chart type and size, that charts check out
+    and return.  The templates waiting in the pool are capped at max_bytes
+    (OMFG_POOL_BYTES, or 256 MiB by default), closing the least recently
+    returned once they go over.  It is safe to use from several threads.
+
+    stats() counts the templates created, reused, discarded and evicted.
+    A template checked out and never returned shows up as outstanding, and
+    a figure the pool closed that is still referenced somewhere as leaked.
+    """
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("OMFG_POOL_BYTES", DEFAULT_MAX_BYTES))
+        self._max_bytes = max_bytes
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        self._closed = weakref.WeakSet()
+        self._counts = {"created": 0, "reused": 0, "discarded": 0, "evicted": 0}
+
+    @property
+    def max_bytes(self):
+        """The cap on the size of the idle templates"""
+        return self._max_bytes
+
+    def checkout(self, key, figsize):
+        """Get the most recently returned template for a key, or a new one"""
+        with self._lock:
+            self._outstanding += 1
+            for template in reversed(self._idle):
+                if template.key == key:
+                    self._idle.remove(template)
+                    self._counts["reused"] += 1
+                    return template
+            self._counts["created"] += 1
+        return FigureTemplate(key, figsize)
+
+    def checkin(self, template):
+        """Return a template, closing it if it is not usable or the pool is full"""
+        with self._lock:
+            self._outstanding -= 1
+            if not template.usable:
+                self._counts["discarded"] += 1
+                self._close(template)
+                return
+            self._idle.append(template)
+            idle_bytes = sum(idle.nbytes for idle in self._idle)
+            while self._idle and idle_bytes > self._max_bytes:
+                evicted = self._idle.popleft()
+                idle_bytes -= evicted.nbytes
+                self._counts["evicted"] += 1
+                self._close(evicted)
+
+    def clear(self):
+        """Close every idle template"""
+        with self._lock:
+            while self._idle:
+                self._close(self._idle.popleft())
+
+    def stats(self):
+        """
+        Get the pool counters, the idle templates and their size, and the
+        outstanding and leaked templates.  Runs the garbage collector first,
+        since a closed figure is only freed once its reference cycles are.
+        """
+        gc.collect()
+        with self._lock:
+            stats = dict(self._counts)
+            stats["idle"] = len(self._idle)
+            stats["idle_bytes"] = sum(template.nbytes for template in self._idle)
+            stats["outstanding"] = self._outstanding
+            stats["leaked"] = len(self._closed)
+        return stats
+
+    def _close(self, template):
+        """Close a template and track its figure until it is freed"""
+        self._closed.add(template.figure)
+        template.close()
+
+
+def get_pool():
+    """Get the figure pool shared by every chart rendered in this process"""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = FigurePool()
+            logging.info("Created figure pool of %d bytes", _POOL.max_bytes)
+        return _POOL
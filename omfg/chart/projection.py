@@ -0,0 +1,53 @@
+"""Map projections and projecting obs onto them"""
+
+from hashlib import sha256
+import numpy as np
+import cartopy.crs as ccrs
+
+PLATE_CARREE = ccrs.PlateCarree()
+
+# projection classes by config name, with the box shown when the chart has none
+PROJECTIONS = {
+    "platecarree": (ccrs.PlateCarree, None),
+    "robinson": (ccrs.Robinson, None),
+    "mollweide": (ccrs.Mollweide, None),
+    "north_polar_stereo": (ccrs.NorthPolarStereo, (20.0, 90.0, -180.0, 180.0)),
+    "south_polar_stereo": (ccrs.SouthPolarStereo, (-90.0, -20.0, -180.0, 180.0))
+}
+DEFAULT_PROJECTION = "platecarree"
+
+
+def get_projection(name=DEFAULT_PROJECTION, central_longitude=0.0):
+    """Get a map projection by its config name"""
+    try:
+        projection_class, _ = PROJECTIONS[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown projection: {name}")
+    if projection_class is ccrs.PlateCarree and central_longitude == 0:
+        return PLATE_CARREE
+    return projection_class(central_longitude=central_longitude)
+
+
+def get_default_bbox(name=DEFAULT_PROJECTION):
+    """Get the (lat_min, lat_max, lon_min, lon_max) box a projection shows by default, or None"""
+    return PROJECTIONS.get(name.lower(), (None, None))[1]
+
+
+def get_projection_key(projection):
+    """Get a short key identifying a projection and its parameters"""
+    return sha256(projection.proj4_init.encode()).hexdigest()[:12]
+
+
+def project_points(projection, lons, lats):
+    """
+    Project lon/lats onto a map projection with one vectorized
+    transform_points call, returning an (n, 2) array of x/y with the points
+    outside the projection's domain as NaN
+    """
+    points = projection.transform_points(
+        PLATE_CARREE,
+        np.asarray(lons, dtype=np.float64),
+        np.asarray(lats, dtype=np.float64)
+    )[:, :2]
+    points[~np.isfinite(points)] = np.nan
+    return np.ascontiguousarray(points)
@@ -1,11 +1,115 @@
-"""Time series for generating map based charts"""
+"""Time series for generating charts of statistics over many cycles"""
 
+import logging
+import numpy as np
 from .chart import Chart
+from omfg.constants import Varno
+from omfg.store import CycleStore, find_cycles, merge_stats, select_stats
+
+DPI = 150
+MAX_TICKS = 10
 
 
 class Timeseries(Chart):
-    """Time-series based chart"""
+    """
+    Time-series based chart of the count, mean, standard deviation, min
+    and max of a column for every cycle from start_cycle to cycle.  Each
+    cycle is read from its compact per-cycle aggregates, computed and
+    cached the first time they are needed, so a long window never loads
+    the raw obs.  The vertco range resolves to whole vertco bins.
+    """
+
+    def render(self, filename):
+        """Render the chart"""
+        self.varno = Varno.get_varno_from_code(self.config["varno"])
+        cycles = self.get_cycles()
+        if not cycles:
+            raise ValueError(f"No cycles found in {self.config['data_path']}")
+        counts, means, stds, mins, maxs = self.load_stats(cycles)
+        means, stds, mins, maxs = self.apply_formula_to_stats(self.varno, means, stds, mins, maxs)
+        self.generate_plot(filename, cycles, counts, means, stds, mins, maxs)
+
+    def get_cycles(self):
+        """Get the sorted cycles in the data path from start_cycle to cycle"""
+        return find_cycles(
+            self.config["data_path"],
+            self.config.get("start_cycle", self.config["cycle"]),
+            self.config["cycle"]
+        )
+
+    def load_stats(self, cycles):
+        """Get arrays of the count, mean, std, min and max for each cycle"""
+        logging.info("Loading aggregates for %d cycles", len(cycles))
+        vertco_min, vertco_max = self.get_vertco_bounds()
+        rows = []
+        for cycle in cycles:
+            stats = CycleStore(self.config["data_path"], cycle).load_stats(
+                self.config["obs_group"],
+                self.config["varno"]
+            )
+            if stats is None:
+                rows.append((0, np.nan, np.nan, np.nan, np.nan))
+                continue
+            rows.append(merge_stats(select_stats(
+                stats, self.config["column"], self.config["vertco_type"], vertco_min, vertco_max
+            )))
+        counts, means, stds, mins, maxs = (np.array(values, dtype=np.float64) for values in zip(*rows))
+        return counts, means, stds, mins, maxs
+
+    def get_image_filename(self):
+        """Get the image filename"""
+        vertco_min, vertco_max = self.config["vertco"].split(",")
+        filestem = "_".join([
+            self.config["chart_type"],
+            str(self.config.get("start_cycle", self.config["cycle"])),
+            str(self.config["cycle"]),
+            self.config["column"],
+            self.config["varno"],
+            self.config["obs_group"],
+            str(self.config["vertco_type"]),
+            vertco_min,
+            vertco_max
+        ])
+        return f"{filestem}.png"
+
+    def get_input_paths(self):
+        """Get the store partitions of every cycle in the window"""
+        paths = []
+        for cycle in self.get_cycles():
+            store = CycleStore(self.config["data_path"], cycle)
+            paths.extend(store.get_source_paths(self.config["obs_group"], self.config["varno"]))
+        return paths
+
+    def generate_plot(self, filename, cycles, counts, means, stds, mins, maxs):
+        """Generate the plot"""
+        logging.info("Generating time series plot")
+        positions = np.arange(len(cycles))
+        stats_ax = self.figure.add_axes([0.1, 0.4, 0.8, 0.45])
+        stats_ax.fill_between(positions, means - stds, means + stds, alpha=0.25, label="Mean ± StDev")
+        stats_ax.plot(positions, means, marker="o", markersize=3, label="Mean")
+        stats_ax.plot(positions, mins, linestyle="--", linewidth=0.75, color="gray", label="Min/Max")
+        stats_ax.plot(positions, maxs, linestyle="--", linewidth=0.75, color="gray")
+        if self.varno.units is not None:
+            stats_ax.set_ylabel(self.varno.units)
+        stats_ax.legend(loc="upper left", fontsize=8)
+        stats_ax.grid(alpha=0.25)
+        stats_ax.set_title(self.get_title(), fontsize=14)
+
+        count_ax = self.figure.add_axes([0.1, 0.12, 0.8, 0.2], sharex=stats_ax)
+        count_ax.bar(positions, counts, color="gray")
+        count_ax.set_ylabel("Obs Count")
+        count_ax.grid(alpha=0.25)
+        ticks = positions[::max(1, int(np.ceil(len(cycles) / MAX_TICKS)))]
+        count_ax.set_xticks(ticks)
+        count_ax.set_xticklabels([cycles[tick] for tick in ticks], rotation=30, ha="right")
+        for label in stats_ax.get_xticklabels():
+            label.set_visible(False)
+        logging.info("Saving")
+        self.figure.savefig(filename, bbox_inches="tight", dpi=DPI, pad_inches=0.25)
 
-    def generate(self):
-        """Generate the chart"""
-        raise NotImplementedError()
+    def get_title(self):
+        """Build the title for the chart"""
+        cycles = f'{self.config.get("start_cycle", self.config["cycle"])} - {self.config["cycle"]}'
+        title = f'Obs Group: {self.config["obs_group"]:25}{self.get_vertco():>46}\n'
+        title += f'{self.get_desc():60}{cycles}'
+        return title
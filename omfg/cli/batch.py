@@ -0,0 +1,118 @@
+"""Batch rendering of many chart configs with shared data loading"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
+import logging
+import time
+
+
+def get_data_key(config):
+    """
+    Get the key of the data file a config reads, or None if the chart
+    loads its own data (timeseries and ad-hoc odb_file charts)
+    """
+    if config.get("chart_type") != "planview" or "odb_file" in config:
+        return None
+    return (config["data_path"], str(config["cycle"]), config["obs_group"], str(config["varno"]))
+
+
+def group_configs(configs):
+    """
+    Group the indexes of the configs by the data file they read, keeping
+    configs that load their own data in groups of one
+    """
+    groups = {}
+    singles = []
+    for index, config in enumerate(configs):
+        key = get_data_key(config)
+        if key is None:
+            singles.append([index])
+        else:
+            groups.setdefault(key, []).append(index)
+    return list(groups.values()) + singles
+
+
+def run_batch(configs, workers=None, threads=1):
+    """
+    Render every config with a pool of worker processes.  Configs that read
+    the same data file go to the same worker, which loads the file once
+    and renders them on `threads` threads, overlapping one chart's PNG
+    encoding with another's numpy work.  Returns one result dict per
+    config, in the order given, with its status, output path (or error)
+    and render time.
+    """
+    results = [None] * len(configs)
+    groups = group_configs(configs)
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(render_group, [configs[index] for index in group], threads): group
+            for group in groups
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            group = futures[future]
+            try:
+                group_results = future.result()
+            except Exception as err:
+                group_results = [_result("FAIL", error=str(err)) for _ in group]
+            for index, result in zip(group, group_results):
+                results[index] = dict(result, config=configs[index])
+            logging.info("[%d/%d] Rendered %d charts", done, len(groups), len(group))
+    logging.info(
+        "Rendered %d charts from %d data groups in %.2fs",
+        len(configs), len(groups), time.perf_counter() - start_time
+    )
+    return results
+
+
+def render_group(configs, threads=1):
+    """
+    Worker task: load the shared data once and render every config in the
+    group on figures from the worker's pool, on a pool of threads if
+    threads is more than 1.  Only the columns the partition has are loaded,
+    and a config reading any other column loads its own data, so it fails
+    with its own error instead of failing the whole group.
+    """
+    from omfg.chart.planview import Planview
+    from omfg.chart.pool import get_pool
+    from omfg.store import CycleStore
+    group_data = [None] * len(configs)
+    key = get_data_key(configs[0])
+    if key is not None:
+        data_path, cycle, obs_group, varno = key
+        store = CycleStore(data_path, cycle)
+        columns = sorted({column for config in configs for column in Planview.get_columns(config)})
+        header = store.read_header(obs_group, varno)
+        if header is not None:
+            names = {field["name"] for field in header["fields"]}
+            columns = [column for column in columns if column in names]
+        data = store.load(obs_group, varno, columns=columns).to_memory()
+        group_data = [
+            data if set(Planview.get_columns(config)) <= set(data.names) else None
+            for config in configs
+        ]
+    pool = get_pool()
+    if threads > 1 and len(configs) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(partial(render_config, pool=pool), configs, group_data))
+    else:
+        results = [render_config(config, data, pool) for config, data in zip(configs, group_data)]
+    logging.info("Figure pool: %s", pool.stats())
+    return results
+
+
+def render_config(config, data=None, pool=None):
+    """Render one chart, returning its result dict rather than raising"""
+    from omfg.cli.generator import generate_chart
+    start_time = time.perf_counter()
+    try:
+        path = generate_chart(config, data, pool)
+        return _result("OK", path=path, seconds=time.perf_counter() - start_time)
+    except Exception as err:
+        logging.exception("Failed to render chart")
+        return _result("FAIL", error=str(err), seconds=time.perf_counter() - start_time)
+
+
+def _result(status, path=None, error=None, seconds=0.0):
+    """Build the result dict for a single chart"""
+    return {"status": status, "path": path, "error": error, "seconds": seconds}
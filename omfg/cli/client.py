@@ -0,0 +1,69 @@
+# /usr/bin/env python3
+
+"""Thin client that sends chart configs to a running omfg-serve"""
+
+from argparse import ArgumentParser
+from pathlib import Path
+import json
+import os
+import socket
+
+DEFAULT_SOCKET = Path.home() / ".omfg" / "omfg.sock"
+# config keys holding paths, which the server would resolve against its own directory
+PATH_KEYS = ("data_path", "odb_file")
+
+
+def get_socket_path():
+    """Get the server socket path from OMFG_SOCKET or the default location"""
+    return Path(os.environ.get("OMFG_SOCKET", str(DEFAULT_SOCKET)))
+
+
+def resolve_paths(config):
+    """Get a copy of a config with its relative paths made absolute from the current directory"""
+    config = dict(config)
+    for key in PATH_KEYS:
+        if config.get(key) is not None:
+            config[key] = os.path.abspath(os.path.expanduser(str(config[key])))
+    return config
+
+
+def request(config, socket_path=None, timeout=None):
+    """
+    Send a chart config to the server and return the lines of its reply,
+    which it sends until it closes the connection: an [OK]path line per
+    chart (several for a chart set), or an [FAIL]err line.  Relative paths
+    in the config are resolved here, as they would be by a local render.
+    Raises OSError if the server can not be reached.
+    """
+    if socket_path is None:
+        socket_path = get_socket_path()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(str(socket_path))
+        client.sendall(json.dumps(resolve_paths(config)).encode() + b"\n")
+        with client.makefile("rb") as fh_in:
+            return fh_in.read().decode().splitlines()
+
+
+def get_args():
+    """Get the command-line arguments"""
+    parser = ArgumentParser(description="Render a chart with a running omfg-serve")
+    parser.add_argument("json_file", help="The JSON configuration file")
+    parser.add_argument("--socket", help="The server socket (defaults to $OMFG_SOCKET or ~/.omfg/omfg.sock)")
+    return parser.parse_args()
+
+
+def main():
+    """Main program"""
+    args = get_args()
+    try:
+        with open(args.json_file, "r") as fh_in:
+            config = json.load(fh_in)
+        for line in request(config, args.socket):
+            print(line)
+    except Exception as err:
+        print(f"[FAIL]{err}")
+
+
+if __name__ == "__main__":
+    main()
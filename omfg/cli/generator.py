@@ -5,19 +5,39 @@
 from argparse import ArgumentParser
 import json
 import logging
+import os
 import traceback
 
+from omfg.cli.batch import run_batch
+from omfg.cli.client import request
 from omfg.util import init_logging
-init_logging(logging.DEBUG)
-
-from omfg.chart.planview import Planview
-from omfg.chart.timeseries import Timeseries
 
 
 def get_args():
     """Get the command-line arguments"""
     parser = ArgumentParser()
     parser.add_argument("json_file", help="The JSON configuration file")
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="The JSON file holds a list of configurations to render together"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="With --batch, the number of worker processes (defaults to the number of CPUs)"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="With --batch, the number of charts each worker process renders at once"
+    )
+    parser.add_argument(
+        "--report",
+        help="With --batch, write the JSON results report to this path instead of stdout"
+    )
     return parser.parse_args()
 
 
@@ -26,19 +46,67 @@ def generate():
     args = get_args()
     with open(args.json_file, "r") as fh_in:
         config = json.load(fh_in)
-    if config["chart_type"] == "planview":
-        chart_generator = Planview(config)
+    return generate_chart(config)
+
+
+def generate_chart(config, data=None, pool=None):
+    """
+    Generate the chart for a config and return the path to the png file,
+    or the list of paths for a config with a vertco_set.  With a
+    FigurePool, the chart reuses a figure an earlier chart prepared.
+    """
+    # each chart type only imports its own plotting stack
+    if "vertco_set" in config:
+        from omfg.chart.chartset import ChartSet
+        chart_generator = ChartSet(config, data, pool)
+    elif config["chart_type"] == "planview":
+        from omfg.chart.planview import Planview
+        chart_generator = Planview(config, data, pool)
     elif config["chart_type"] == "timeseries":
-        chart_generator = Timeseries(config)
+        from omfg.chart.timeseries import Timeseries
+        chart_generator = Timeseries(config, data, pool)
     else:
         raise ValueError(f"Unknown chart type: {config['chart_type']}")
-    return chart_generator.generate()
+    try:
+        return chart_generator.generate()
+    finally:
+        chart_generator.close()
+
+
+def generate_batch(args):
+    """Render every config in a batch file and write the results report"""
+    with open(args.json_file, "r") as fh_in:
+        configs = json.load(fh_in)
+    results = run_batch(configs, args.workers, args.threads)
+    if args.report is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.report, "w") as fh_out:
+            json.dump(results, fh_out, indent=2)
+    failures = sum(1 for result in results if result["status"] != "OK")
+    return f"{len(results) - failures} of {len(results)} charts rendered"
 
 
 def main():
     """Main program"""
+    args = get_args()
+    init_logging(logging.DEBUG)
+    if "OMFG_SOCKET" in os.environ and not args.batch:
+        # hand the chart to a running omfg-serve, rendering locally if there is none
+        try:
+            with open(args.json_file, "r") as fh_in:
+                for line in request(json.load(fh_in)):
+                    print(line)
+            return
+        except OSError as err:
+            logging.warning("Unable to reach omfg-serve, rendering locally: %s", err)
     try:
-        print(f"[OK]{generate()}")
+        if args.batch:
+            print(f"[OK]{generate_batch(args)}")
+        else:
+            paths = generate()
+            for path in paths if isinstance(paths, list) else [paths]:
+                print(f"[OK]{path}")
     except Exception as err:
         traceback.print_exc()
         print(f"[FAIL]{err}")
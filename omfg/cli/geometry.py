@@ -0,0 +1,42 @@
+# /usr/bin/env python3
+
+"""Program interface for preprocessing the Natural Earth geometry packaged with omfg"""
+
+from argparse import ArgumentParser
+import traceback
+
+from omfg.chart.geometry import GEOMETRY_PATH, build_geometry
+from omfg.util import init_logging
+
+
+def get_args():
+    """Get the command-line arguments"""
+    parser = ArgumentParser(
+        description="Simplify and clip the Natural Earth shapefiles into the packaged geometry file"
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=str(GEOMETRY_PATH.parent),
+        help="The cartopy data directory holding the shapefiles (defaults to the packaged one)"
+    )
+    parser.add_argument(
+        "--output",
+        default=str(GEOMETRY_PATH),
+        help="The geometry file to write (defaults to the packaged one)"
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Main program"""
+    init_logging()
+    args = get_args()
+    try:
+        print(f"[OK]{build_geometry(args.data_dir, args.output)}")
+    except Exception as err:
+        traceback.print_exc()
+        print(f"[FAIL]{err}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# /usr/bin/env python3
+
+"""Program interface for incrementally ingesting the ODB2 files of a cycle in parallel"""
+
+from argparse import ArgumentParser
+import json
+import logging
+import traceback
+
+from omfg.store import CycleStore, find_odb_files, ingest_files
+from omfg.util import init_logging
+from omfg.cli.schema import add_schema_args, get_schema
+from omfg.wrappers.odb import DEFAULT_CHUNK_SIZE
+
+
+def get_args():
+    """Get the command-line arguments"""
+    parser = ArgumentParser(
+        description="Ingest ODB2 files into <obs_group>_<varno>.npy partitions"
+    )
+    parser.add_argument("data_path", help="The root directory of the per-cycle store")
+    parser.add_argument("cycle", help="The cycle the ODB2 files belong to")
+    parser.add_argument("paths", nargs="+", help="ODB2 files or directories containing them")
+    parser.add_argument(
+        "--pattern",
+        default="*.odb",
+        help="The glob pattern used to find ODB2 files in directories"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="The number of worker processes (defaults to the number of CPUs)"
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="The number of rows read from an ODB2 file at a time"
+    )
+    parser.add_argument("--report", help="Write a JSON report of every file to this path")
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Write one memory-mappable file per field instead of one file per partition"
+    )
+    add_schema_args(parser)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Re-read every file even if the manifest says it is unchanged"
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Main program"""
+    args = get_args()
+    init_logging(logging.INFO)
+    try:
+        filenames = find_odb_files(args.paths, args.pattern)
+        store = CycleStore(args.data_path, args.cycle, args.columnar, get_schema(args))
+        reports = ingest_files(filenames, store, args.workers, args.chunk_size, force=args.force)
+        if args.report is not None:
+            with open(args.report, "w") as fh_out:
+                json.dump(reports, fh_out, indent=2)
+        failures = [report for report in reports if report["status"] == "FAIL"]
+        if failures:
+            print(f"[FAIL]{len(failures)} of {len(reports)} files failed")
+        else:
+            print(f"[OK]{len(reports)}")
+    except Exception as err:
+        traceback.print_exc()
+        print(f"[FAIL]{err}")
+
+
+if __name__ == "__main__":
+    main()
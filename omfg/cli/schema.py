@@ -0,0 +1,40 @@
+"""Command-line options shared by the programs that write partitions"""
+
+from omfg.store import CompactSchema
+
+
+def add_schema_args(parser):
+    """Add the compact schema options to an ArgumentParser"""
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Store floats as f4 and codes as small integers"
+    )
+    parser.add_argument(
+        "--quantize-latlon",
+        action="store_true",
+        help="With --compact and --columnar, store lat/lon as int16 hundredths of a degree"
+    )
+    parser.add_argument(
+        "--rtol",
+        type=float,
+        default=1e-6,
+        help="The relative error allowed when downcasting"
+    )
+    parser.add_argument(
+        "--on-downcast-error",
+        choices=["fail", "fallback"],
+        default="fail",
+        help="Fail, or keep the original type, when a downcast exceeds the error bounds"
+    )
+
+
+def get_schema(args):
+    """Get the CompactSchema selected by the command-line arguments, or None"""
+    if not args.compact:
+        return None
+    return CompactSchema(
+        rtol=args.rtol,
+        quantize_latlon=args.quantize_latlon,
+        on_error=args.on_downcast_error
+    )
@@ -0,0 +1,131 @@
+# /usr/bin/env python3
+
+"""Long-running chart server that keeps the plotting stack warm"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+import json
+import logging
+import os
+import signal
+import socketserver
+import sys
+import threading
+
+from omfg.cli.client import get_socket_path
+from omfg.util import init_logging
+
+
+class ChartRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Read one JSON config per connection and reply with an [OK]path line
+    per chart, as omfg-generate prints them, or an [FAIL]err line
+    """
+    def handle(self):
+        try:
+            config = json.loads(self.rfile.readline().decode())
+            paths = self.server.render(config)
+            lines = [f"[OK]{path}" for path in (paths if isinstance(paths, list) else [paths])]
+        except Exception as err:
+            logging.exception("Failed to render chart")
+            lines = [f"[FAIL]{err}"]
+        self.wfile.write("".join(f"{line}\n" for line in lines).encode())
+
+
+class ChartServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix socket server that hands each request to a bounded pool of warm
+    worker processes.  Connections are accepted on threads, but at most
+    `workers` charts render at once.  A worker that dies (for example
+    killed for running out of memory) breaks the whole pool, so the pool
+    is replaced with fresh warm workers and the request is tried once more.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, workers):
+        self.workers = workers or os.cpu_count()
+        self._executor_lock = threading.Lock()
+        self.executor = self.start_executor()
+        super().__init__(str(socket_path), ChartRequestHandler)
+
+    def start_executor(self):
+        """Start a pool of warm workers"""
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+        # start every worker now rather than on the first requests
+        for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+        return executor
+
+    def render(self, config):
+        """Render a chart in the pool, replacing a broken pool and retrying once"""
+        executor = self.executor
+        try:
+            return executor.submit(render, config).result()
+        except BrokenProcessPool:
+            logging.error("A chart worker died, restarting the worker pool")
+            self.restart_executor(executor)
+        return self.executor.submit(render, config).result()
+
+    def restart_executor(self, broken):
+        """Replace a broken pool, unless a request on another thread already has"""
+        with self._executor_lock:
+            if self.executor is broken:
+                broken.shutdown(wait=False)
+                self.executor = self.start_executor()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+
+
+def warm_up():
+    """Import the plotting stack once per worker so charts skip the startup cost"""
+    import omfg.chart.planview
+    import omfg.chart.timeseries
+
+
+def render(config):
+    """Worker task: render one chart on a figure from the worker's pool"""
+    from omfg.chart.pool import get_pool
+    from omfg.cli.generator import generate_chart
+    return generate_chart(config, pool=get_pool())
+
+
+def get_args():
+    """Get the command-line arguments"""
+    parser = ArgumentParser(description="Serve chart requests over a Unix domain socket")
+    parser.add_argument("--socket", help="The server socket (defaults to $OMFG_SOCKET or ~/.omfg/omfg.sock)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="The number of charts rendered at once (defaults to the number of CPUs)"
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Main program"""
+    args = get_args()
+    init_logging(logging.INFO)
+    socket_path = Path(args.socket) if args.socket else get_socket_path()
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    if socket_path.exists():
+        os.unlink(str(socket_path))
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    server = ChartServer(socket_path, args.workers)
+    logging.info("Serving charts on %s", str(socket_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path.exists():
+            os.unlink(str(socket_path))
+
+
+if __name__ == "__main__":
+    main()
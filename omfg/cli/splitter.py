@@ -0,0 +1,66 @@
+# /usr/bin/env python3
+
+"""Program interface for splitting an ODB2 file into per-cycle partitions"""
+
+from argparse import ArgumentParser
+import logging
+import traceback
+
+from omfg.store import CycleStore, split_partitions
+from omfg.util import init_logging
+from omfg.cli.schema import add_schema_args, get_schema
+from omfg.wrappers import ODB
+from omfg.wrappers.odb import DEFAULT_CHUNK_SIZE
+
+
+def get_args():
+    """Get the command-line arguments"""
+    parser = ArgumentParser(
+        description="Split an ODB2 file into <obs_group>_<varno>.npy partitions"
+    )
+    parser.add_argument("odb_file", help="The ODB2 file to split")
+    parser.add_argument("data_path", help="The root directory of the per-cycle store")
+    parser.add_argument("cycle", help="The cycle the ODB2 file belongs to")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="The number of rows read from the ODB2 file at a time"
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Write one memory-mappable file per field instead of one file per partition"
+    )
+    add_schema_args(parser)
+    return parser.parse_args()
+
+
+def split(odb_file, data_path, cycle, chunk_size=DEFAULT_CHUNK_SIZE, columnar=False, schema=None):
+    """Read the ODB2 file once and write every obs group/varno partition"""
+    odb = ODB(odb_file, chunk_size=chunk_size)
+    store = CycleStore(data_path, cycle, columnar, schema)
+    filepaths = []
+    for obs_group, varno, partition in split_partitions(odb.data):
+        filepaths.append(store.write(obs_group, varno, partition))
+    logging.info("Wrote %d partitions to %s", len(filepaths), str(store.path))
+    return filepaths
+
+
+def main():
+    """Main program"""
+    args = get_args()
+    init_logging(logging.INFO)
+    try:
+        filepaths = split(
+            args.odb_file, args.data_path, args.cycle, args.chunk_size, args.columnar,
+            get_schema(args)
+        )
+        print(f"[OK]{len(filepaths)}")
+    except Exception as err:
+        traceback.print_exc()
+        print(f"[FAIL]{err}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# /usr/bin/env python3
+
+"""Program interface for querying the per-cycle aggregates of a store"""
+
+from argparse import ArgumentParser
+import json
+import traceback
+
+from omfg.store import CycleStore, find_cycles, query_stats
+
+
+def get_args():
+    """Get the command-line arguments"""
+    parser = ArgumentParser(
+        description="Get the count, mean, std, min and max of a column over cycles and a vertco range"
+    )
+    parser.add_argument("data_path", help="The root directory of the per-cycle store")
+    parser.add_argument("cycle", help="The last cycle of the window")
+    parser.add_argument("obs_group", help="The obs group")
+    parser.add_argument("varno", help="The varno code")
+    parser.add_argument("column", help="The column, for example obsvalue@body or fg_depar@body")
+    parser.add_argument("vertco_type", help="The vertco type code")
+    parser.add_argument("vertco", help="The vertco range as min,max")
+    parser.add_argument("--start-cycle", help="The first cycle of the window (defaults to cycle)")
+    return parser.parse_args()
+
+
+def main():
+    """Main program"""
+    args = get_args()
+    try:
+        cycles = find_cycles(args.data_path, args.start_cycle or args.cycle, args.cycle)
+        vertco_min, vertco_max = args.vertco.split(",")
+        result = query_stats(
+            [CycleStore(args.data_path, cycle) for cycle in cycles],
+            args.obs_group,
+            args.varno,
+            args.column,
+            args.vertco_type,
+            vertco_min,
+            vertco_max
+        )
+        result["cycles"] = len(cycles)
+        print(json.dumps(result, indent=2))
+    except Exception as err:
+        traceback.print_exc()
+        print(f"[FAIL]{err}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 """Module for storing constant variables and static classes."""
 
 from .column import Column
+from .region import Region
 from .subtype import Subtype
 from .varno import Varno
 from .vertco import VertcoType
@@ -8,6 +9,7 @@ from .vertco import VertcoType
 
 __all__ = [
     "Column",
+    "Region",
     "Subtype",
     "Varno",
     "VertcoType"
@@ -0,0 +1,44 @@
+"""Module for named map regions"""
+
+
+class Region:
+    """Static class for looking up named map regions."""
+    @staticmethod
+    def get_bbox(name):
+        """Retrieve the (lat_min, lat_max, lon_min, lon_max) box of the given region name"""
+        try:
+            return REGIONS[name.lower()]
+        except KeyError:
+            return None
+
+    @staticmethod
+    def get_config_bbox(config):
+        """
+        Get the (lat_min, lat_max, lon_min, lon_max) box of a chart config,
+        from its bbox key ("lat_min,lat_max,lon_min,lon_max") or else its
+        region key, or None for a global chart
+        """
+        if config.get("bbox") is not None:
+            bbox = tuple(float(value) for value in str(config["bbox"]).split(","))
+            if len(bbox) != 4:
+                raise ValueError(f"Invalid bbox: {config['bbox']}")
+            return bbox
+        if config.get("region") is not None:
+            bbox = Region.get_bbox(config["region"])
+            if bbox is None:
+                raise ValueError(f"Unknown region: {config['region']}")
+            return bbox
+        return None
+
+
+# (lat_min, lat_max, lon_min, lon_max); a lon_min greater than lon_max crosses the dateline
+REGIONS = {
+    "conus": (20.0, 55.0, -130.0, -60.0),
+    "north_america": (10.0, 75.0, -170.0, -50.0),
+    "europe": (30.0, 75.0, -30.0, 45.0),
+    "asia": (0.0, 60.0, 60.0, 150.0),
+    "pacific": (-60.0, 60.0, 120.0, -70.0),
+    "arctic": (60.0, 90.0, -180.0, 180.0),
+    "antarctic": (-90.0, -60.0, -180.0, 180.0),
+    "tropics": (-30.0, 30.0, -180.0, 180.0)
+}
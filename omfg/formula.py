@@ -0,0 +1,191 @@
+"""Safe compiled formulas for transforming observation values"""
+
+from functools import lru_cache
+import ast
+import numpy as np
+
+DEFAULT_CHUNK_SIZE = 1 << 18
+
+_BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.Mod: np.mod,
+    ast.Pow: np.power
+}
+
+_UNARY_OPERATORS = {
+    ast.UAdd: np.positive,
+    ast.USub: np.negative
+}
+
+_UNARY_FUNCTIONS = {
+    "abs": np.absolute,
+    "sqrt": np.sqrt,
+    "exp": np.exp,
+    "log": np.log,
+    "log10": np.log10,
+    "sin": np.sin,
+    "cos": np.cos,
+    "tan": np.tan,
+    "degrees": np.degrees,
+    "radians": np.radians
+}
+
+_BINARY_FUNCTIONS = {
+    "arctan2": np.arctan2,
+    "hypot": np.hypot,
+    "minimum": np.minimum,
+    "maximum": np.maximum
+}
+
+# unit conversions are an operation with a fixed right-hand operand
+_UNIT_CONVERSIONS = {
+    "kelvin_to_celsius": (np.subtract, 273.15),
+    "celsius_to_kelvin": (np.add, 273.15),
+    "pa_to_hpa": (np.true_divide, 100.0),
+    "hpa_to_pa": (np.multiply, 100.0),
+    "ms_to_knots": (np.multiply, 3600 / 1852)
+}
+
+_CONSTANTS = {
+    "pi": np.pi
+}
+
+VARIABLE = "data"
+
+
+class Formula:
+    """
+    A formula compiled from an allow-listed expression grammar: numbers,
+    the variable data, + - * / % ** and unary minus, the numpy ufuncs in
+    _UNARY_FUNCTIONS and _BINARY_FUNCTIONS, the unit conversions in
+    _UNIT_CONVERSIONS (kelvin_to_celsius(data)) and the constant pi.  The
+    expression is parsed once into a tree of ufunc calls with every
+    constant part folded, and nothing is ever passed to eval.
+
+    Calling a formula runs it over the array in chunks, writing into out
+    (which may be the input array itself), so it never needs more than a
+    chunk's worth of temporary memory.
+    """
+    def __init__(self, source):
+        self._source = source
+        try:
+            tree = ast.parse(source.strip(), mode="eval")
+        except SyntaxError as err:
+            raise ValueError(f"Invalid formula {source!r}: {err.msg}")
+        self._kernel = self._compile(tree.body)
+        self._reads = sum(
+            isinstance(child, ast.Name) and child.id == VARIABLE for child in ast.walk(tree)
+        )
+
+    @property
+    def source(self):
+        """The formula's source expression"""
+        return self._source
+
+    def __repr__(self):
+        return f"Formula({self._source!r})"
+
+    def __call__(self, data, out=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Apply the formula to a 1-d float array, returning out (a new array if None)"""
+        data = np.asarray(data)
+        if out is None:
+            out = np.empty(data.shape, dtype=np.result_type(data.dtype, np.float64))
+        if callable(self._kernel):
+            in_place = np.may_share_memory(data, out)
+            for start in range(0, len(data), chunk_size):
+                chunk = data[start:start + chunk_size]
+                if in_place and self._reads > 1:
+                    # the chunk is overwritten before its last read
+                    chunk = chunk.copy()
+                self._kernel(chunk, out[start:start + chunk_size])
+        else:
+            out[...] = self._kernel
+        return out
+
+    def _compile(self, node):
+        """
+        Compile a node into either a constant number or a kernel function
+        that writes the node's value for a chunk of data into out
+        """
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+            return _binary(
+                _BINARY_OPERATORS[type(node.op)], self._compile(node.left), self._compile(node.right)
+            )
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+            return _unary(_UNARY_OPERATORS[type(node.op)], self._compile(node.operand))
+        if isinstance(node, ast.Name):
+            if node.id == VARIABLE:
+                return _load
+            if node.id in _CONSTANTS:
+                return _CONSTANTS[node.id]
+            raise ValueError(f"Unknown name {node.id!r} in formula {self._source!r}")
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            name, arity = node.func.id, len(node.args)
+            if name in _UNARY_FUNCTIONS and arity == 1:
+                return _unary(_UNARY_FUNCTIONS[name], self._compile(node.args[0]))
+            if name in _BINARY_FUNCTIONS and arity == 2:
+                return _binary(_BINARY_FUNCTIONS[name], *map(self._compile, node.args))
+            if name in _UNIT_CONVERSIONS and arity == 1:
+                ufunc, operand = _UNIT_CONVERSIONS[name]
+                return _binary(ufunc, self._compile(node.args[0]), operand)
+            raise ValueError(f"Unknown function {name!r} in formula {self._source!r}")
+        number = _get_number(node)
+        if number is not None:
+            return number
+        raise ValueError(f"Unsupported expression {type(node).__name__} in formula {self._source!r}")
+
+
+@lru_cache(maxsize=None)
+def compile_formula(source):
+    """Get the compiled Formula for a source expression, compiling each one only once"""
+    return Formula(source)
+
+
+def _get_number(node):
+    """Get the value of a numeric literal node, or None if it is not one"""
+    value = getattr(node, "value", getattr(node, "n", None))
+    if type(node).__name__ in ("Constant", "Num") and isinstance(value, (int, float)) \
+            and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def _load(data, out):
+    """Kernel for the data variable"""
+    if data is not out and not np.may_share_memory(data, out):
+        np.copyto(out, data)
+
+
+def _unary(ufunc, operand):
+    """Build the kernel (or fold the constant) for a unary ufunc"""
+    if not callable(operand):
+        return float(ufunc(operand))
+
+    def kernel(data, out):
+        operand(data, out)
+        ufunc(out, out=out)
+    return kernel
+
+
+def _binary(ufunc, left, right):
+    """Build the kernel (or fold the constant) for a binary ufunc"""
+    if not callable(left) and not callable(right):
+        return float(ufunc(left, right))
+    if not callable(right):
+        def kernel(data, out):
+            left(data, out)
+            ufunc(out, right, out=out)
+    elif not callable(left):
+        def kernel(data, out):
+            right(data, out)
+            ufunc(left, out, out=out)
+    else:
+        def kernel(data, out):
+            left(data, out)
+            scratch = np.empty_like(out)
+            right(data, scratch)
+            ufunc(out, scratch, out=out)
+    return kernel
@@ -0,0 +1,29 @@
+"""Module for the on-disk store of per-cycle observation partitions"""
+
+from .cells import CellIndex, in_bbox
+from .cycle import CycleStore, find_cycles, Partition
+from .ingest import find_odb_files, ingest_files
+from .manifest import Manifest
+from .partition import get_obs_group, split_partitions
+from .schema import CompactSchema
+from .stats import combine_stats, compute_stats, is_exact_range, merge_stats, query_stats, select_stats
+
+__all__ = [
+    "CellIndex",
+    "combine_stats",
+    "CompactSchema",
+    "compute_stats",
+    "CycleStore",
+    "find_cycles",
+    "find_odb_files",
+    "get_obs_group",
+    "in_bbox",
+    "ingest_files",
+    "is_exact_range",
+    "Manifest",
+    "merge_stats",
+    "Partition",
+    "query_stats",
+    "select_stats",
+    "split_partitions"
+]
@@ -0,0 +1,160 @@
+"""Coarse lat/lon cell index for selecting the rows of a partition inside a bounding box"""
+
+from math import floor
+import numpy as np
+
+DEFAULT_CELL_SIZE = 2.0
+# below this many rows masking every row is cheaper than reading an index
+MIN_INDEX_ROWS = 100000
+
+
+class CellIndex:
+    """
+    The rows of a partition grouped by the cell_size degree lat/lon cell
+    they fall in.  order lists the row numbers sorted by cell, cells lists
+    the ids of the cells holding any rows in ascending order, and the rows
+    of cells[i] are order[offsets[i]:offsets[i + 1]], so the empty cells
+    take no space.  Within a cell the rows keep the partition's vertco
+    order, so a vertco slice of the partition is a contiguous run of each
+    cell's rows.  Rows without a lat/lon are left out, since they are never
+    inside a bounding box.
+    """
+    def __init__(self, order, cells, offsets, cell_size):
+        self._order = order
+        self._cells = cells
+        self._offsets = offsets
+        self._cell_size = float(cell_size)
+
+    @property
+    def cell_size(self):
+        """The size of the cells in degrees"""
+        return self._cell_size
+
+    @property
+    def shape(self):
+        """The number of cell rows (latitude) and columns (longitude)"""
+        return int(round(180 / self._cell_size)), int(round(360 / self._cell_size))
+
+    @staticmethod
+    def build(lats, lons, cell_size=DEFAULT_CELL_SIZE):
+        """Build the index of a partition's lat/lon columns"""
+        index = CellIndex(None, None, None, cell_size)
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        rows = np.flatnonzero(~np.isnan(lats) & ~np.isnan(lons))
+        cell_ids = index.get_cell_ids(lats[rows], lons[rows])
+        # the stable sort keeps each cell's rows in partition order
+        sort_order = np.argsort(cell_ids, kind="stable")
+        cells, counts = np.unique(cell_ids[sort_order], return_counts=True)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        dtype = np.int32 if len(lats) < np.iinfo(np.int32).max else np.int64
+        return CellIndex(
+            rows[sort_order].astype(dtype), cells.astype(np.int32), offsets.astype(dtype), cell_size
+        )
+
+    @staticmethod
+    def load(filepath):
+        """
+        Load an index and the token it was saved with, or (None, None) if
+        there is none or it is in an older layout, which is ignored until
+        the partition is written again
+        """
+        try:
+            with np.load(str(filepath)) as arrays:
+                index = CellIndex(
+                    arrays["order"], arrays["cells"], arrays["offsets"], float(arrays["cell_size"])
+                )
+                token = str(arrays["token"]) if "token" in arrays else None
+        except (FileNotFoundError, KeyError):
+            return None, None
+        return index, token
+
+    def save(self, fh_out, token=None):
+        """Save the index, with the token of the partition version it describes"""
+        arrays = {
+            "order": self._order,
+            "cells": self._cells,
+            "offsets": self._offsets,
+            "cell_size": self._cell_size
+        }
+        if token is not None:
+            arrays["token"] = token
+        np.savez_compressed(fh_out, **arrays)
+
+    def get_cell_ids(self, lats, lons):
+        """Get the cell of each lat/lon, with the poles and the dateline in the edge cells"""
+        n_rows, n_cols = self.shape
+        cell_rows = np.clip(np.floor((lats + 90) / self._cell_size), 0, n_rows - 1)
+        cell_cols = np.clip(np.floor((lons + 180) / self._cell_size), 0, n_cols - 1)
+        return (cell_rows * n_cols + cell_cols).astype(np.int64)
+
+    def get_cells(self, bbox):
+        """
+        Get the cells overlapping a (lat_min, lat_max, lon_min, lon_max) box.
+        A box whose lon_min is greater than its lon_max crosses the dateline.
+        """
+        lat_min, lat_max, lon_min, lon_max = bbox
+        n_rows, n_cols = self.shape
+        cell_rows = np.arange(
+            self._get_edge(lat_min + 90, n_rows), self._get_edge(lat_max + 90, n_rows) + 1
+        )
+        first_col = self._get_edge(lon_min + 180, n_cols)
+        last_col = self._get_edge(lon_max + 180, n_cols)
+        if lon_min <= lon_max:
+            cell_cols = np.arange(first_col, last_col + 1)
+        else:
+            cell_cols = np.concatenate((np.arange(first_col, n_cols), np.arange(0, last_col + 1)))
+        return (cell_rows[:, np.newaxis] * n_cols + cell_cols[np.newaxis, :]).ravel()
+
+    def get_rows(self, bbox, rows=None):
+        """
+        Get the sorted row numbers in the cells overlapping a box, limited
+        to a slice of rows (such as a vertco slice) if given.  Only the
+        overlapping cells are read, and rows near the edges of the box may
+        be outside it, so callers still have to mask the exact box.
+        """
+        cells = self.get_cells(bbox)
+        # only the overlapping cells that hold rows are in the index
+        cell_positions = np.searchsorted(self._cells, cells)
+        inside = cell_positions < len(self._cells)
+        cell_positions = cell_positions[inside]
+        found = cell_positions[self._cells[cell_positions] == cells[inside]]
+        starts = self._offsets[found].astype(np.int64)
+        stops = self._offsets[found + 1].astype(np.int64)
+        if rows is not None:
+            # each cell's rows are in partition order, so a slice of rows is a run of them
+            starts, stops = (self._search(starts, stops, row) for row in (rows.start, rows.stop))
+        lengths = stops - starts
+        # gather every cell's run of positions in order at once
+        positions = np.arange(lengths.sum())
+        positions += np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return np.sort(self._order[positions].astype(np.int64))
+
+    def _search(self, starts, stops, row):
+        """
+        Binary search every cell's run of order[starts:stops] at once for the
+        position of the first row number that is not less than row
+        """
+        low, high = starts.copy(), stops.copy()
+        active = low < high
+        while active.any():
+            middle = (low + high) // 2
+            below = active & (self._order[np.minimum(middle, len(self._order) - 1)] < row)
+            low = np.where(below, middle + 1, low)
+            high = np.where(active & ~below, middle, high)
+            active = low < high
+        return low
+
+    def _get_edge(self, degrees, count):
+        """Get the cell along one axis holding a position in degrees from its start"""
+        return min(max(floor(degrees / self._cell_size), 0), count - 1)
+
+
+def in_bbox(lats, lons, bbox):
+    """Get the mask of the lat/lons inside a (lat_min, lat_max, lon_min, lon_max) box"""
+    lat_min, lat_max, lon_min, lon_max = bbox
+    condition = (lats >= lat_min) & (lats <= lat_max)
+    if lon_min <= lon_max:
+        return condition & (lons >= lon_min) & (lons <= lon_max)
+    # the box crosses the dateline
+    return condition & ((lons >= lon_min) | (lons <= lon_max))
@@ -0,0 +1,498 @@
+"""The per-cycle directory of <obs_group>_<varno> partitions"""
+
+from pathlib import Path
+from uuid import uuid4
+import json
+import logging
+import os
+import shutil
+import numpy as np
+from omfg.util import atomic_open, get_temp_path
+from .cells import MIN_INDEX_ROWS, CellIndex
+from .partition import sort_by_vertco
+from .stats import STATS_COLUMNS, STATS_VERSION, compute_stats
+
+HEADER_FILENAME = "header.json"
+INDEX_FILENAME = "index.json"
+CELLS_FILENAME = "cells.npz"
+STATS_DIRNAME = "stats"
+PROJECTED_DIRNAME = "projected"
+
+
+class ScaledColumn:
+    """
+    A column stored as scaled integers.  Indexing it returns float64 values
+    and only converts the rows that are selected.
+    """
+    def __init__(self, column, scale):
+        self._column = column
+        self._scale = scale
+
+    def __getitem__(self, key):
+        return self._column[key] * self._scale
+
+    def __len__(self):
+        return len(self._column)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self._column * self._scale, dtype=dtype)
+
+
+class Partition:
+    """
+    A loaded partition that can be indexed by field name.  The vertco index
+    is only attached when it is known to describe the loaded rows.  Columns
+    stored as scaled integers are returned as a ScaledColumn, so compact
+    and full precision partitions read the same way.
+    """
+    def __init__(self, columns, rows, vertco_index=None, scales=None, cell_index=None):
+        self._columns = columns
+        self._rows = rows
+        self._vertco_index = vertco_index
+        self._scales = {} if scales is None else scales
+        self._cell_index = cell_index
+
+    def __getitem__(self, name):
+        if name in self._scales:
+            return ScaledColumn(self._columns[name], self._scales[name])
+        return self._columns[name]
+
+    def __len__(self):
+        return self._rows
+
+    @property
+    def names(self):
+        """The names of the loaded fields"""
+        if isinstance(self._columns, dict):
+            return list(self._columns)
+        return list(self._columns.dtype.names)
+
+    def to_memory(self):
+        """Get a copy of the partition with every column read into memory"""
+        if isinstance(self._columns, dict):
+            columns = {name: np.array(column) for name, column in self._columns.items()}
+        else:
+            columns = np.array(self._columns)
+        return Partition(columns, self._rows, self._vertco_index, self._scales, self._cell_index)
+
+    @property
+    def vertco_index(self):
+        """Map of vertco type to [start, nan_start, stop) row offsets, or None"""
+        return self._vertco_index
+
+    @property
+    def cell_index(self):
+        """The CellIndex of the rows' lat/lon cells, or None"""
+        return self._cell_index
+
+    def get_bbox_rows(self, bbox, rows=None):
+        """
+        Get the sorted rows in the lat/lon cells overlapping a (lat_min,
+        lat_max, lon_min, lon_max) box, within a slice of rows if given.
+        The rows near the edges of the box still need masking.  Returns None
+        if the partition has no cell index, in which case the caller has to
+        mask every row.
+        """
+        if self._cell_index is None:
+            return None
+        return self._cell_index.get_rows(bbox, rows)
+
+    def get_vertco_slice(self, vertco_type, vertco_min, vertco_max):
+        """
+        Get the slice of rows whose vertco_type matches and whose
+        vertco_reference_1 is within [vertco_min, vertco_max], using binary
+        searches over the sorted references.  Returns None if the partition
+        has no vertco index, in which case the caller has to mask the rows.
+        """
+        if self._vertco_index is None:
+            return None
+        if int(vertco_type) not in self._vertco_index:
+            return slice(0, 0)
+        start, nan_start, _ = self._vertco_index[int(vertco_type)]
+        sorted_references = self["vertco_reference_1@body"][start:nan_start]
+        return slice(
+            start + int(np.searchsorted(sorted_references, vertco_min, side="left")),
+            start + int(np.searchsorted(sorted_references, vertco_max, side="right"))
+        )
+
+
+class CycleStore:
+    """
+    Directory holding the partitions for a cycle, one per obs group and
+    varno.  A partition is either a single structured numpy file,
+    data_path/<cycle>/<obs_group>_<varno>.npy, or, when columnar is set,
+    a directory data_path/<cycle>/<obs_group>_<varno>/ with one numpy file
+    per field and a header.json describing them.  Both layouts can be read
+    regardless of the columnar setting.
+
+    Partitions are written sorted by vertco_type and vertco_reference_1
+    with a small vertco index alongside them (<obs_group>_<varno>.index.json,
+    or index.json inside a columnar partition), so a vertco range resolves
+    to a contiguous slice of rows.  A CellIndex of the rows in each coarse
+    lat/lon cell (<obs_group>_<varno>.cells.npz, or cells.npz) lets a
+    bounding box read only the rows of the cells it overlaps.  Partitions
+    under MIN_INDEX_ROWS rows have no cell index, since masking all their
+    rows is cheaper.
+
+    A CompactSchema can be given to downcast the stored types; lat/lon
+    quantized to scaled integers need the columnar layout, where the header
+    records the scale of each field.
+
+    Every write is committed with an atomic rename, so a reader sees either
+    the old or the new partition and never a partially written one.  A
+    columnar partition is a symlink to a hidden versioned directory, which
+    is swapped in one step.  Writing a partition in one layout removes its
+    files in the other layout as soon as the new version is committed.
+    """
+    def __init__(self, data_path, cycle, columnar=False, schema=None):
+        if schema is not None and schema.quantize_latlon and not columnar:
+            raise ValueError("Quantized lat/lon needs the columnar layout")
+        self._path = Path(data_path) / str(cycle)
+        self._columnar = columnar
+        self._schema = schema
+
+    @property
+    def path(self):
+        """The Path to the cycle directory"""
+        return self._path
+
+    @property
+    def columnar(self):
+        """Whether partitions are written with the columnar layout"""
+        return self._columnar
+
+    @property
+    def partitions(self):
+        """Get a sorted list of (obs_group, varno) tuples found in the store"""
+        partitions = set()
+        if self._path.is_dir():
+            for filepath in self._path.glob("*_*"):
+                if filepath.name.startswith("."):
+                    continue
+                if filepath.suffix == ".npy" or (filepath / HEADER_FILENAME).is_file():
+                    obs_group, varno = filepath.stem.rsplit("_", 1)
+                    partitions.add((obs_group, int(varno)))
+        return sorted(partitions)
+
+    def get_partition_path(self, obs_group, varno):
+        """Get the Path to the numpy file for the given obs group and varno"""
+        return self._path / f"{obs_group}_{varno}.npy"
+
+    def get_columnar_path(self, obs_group, varno):
+        """Get the Path to the columnar directory for the given obs group and varno"""
+        return self._path / f"{obs_group}_{varno}"
+
+    def get_index_path(self, obs_group, varno):
+        """Get the Path to the vertco index of a single-file partition"""
+        return self._path / f"{obs_group}_{varno}.{INDEX_FILENAME}"
+
+    def get_cells_path(self, obs_group, varno):
+        """Get the Path to the cell index of a single-file partition"""
+        return self._path / f"{obs_group}_{varno}.{CELLS_FILENAME}"
+
+    def get_source_paths(self, obs_group, varno):
+        """
+        Get the Paths of the files currently holding a partition, with a
+        columnar partition resolved to its version directory
+        """
+        columnar_path = self.get_columnar_path(obs_group, varno).resolve()
+        if (columnar_path / HEADER_FILENAME).is_file():
+            return [columnar_path]
+        return [
+            filepath for filepath in
+            (self.get_partition_path(obs_group, varno), self.get_index_path(obs_group, varno))
+            if filepath.is_file()
+        ]
+
+    def get_stats_path(self, obs_group, varno):
+        """Get the Path to the cached aggregates of a partition"""
+        return self._path / STATS_DIRNAME / f"{obs_group}_{varno}.npy"
+
+    def get_token(self, obs_group, varno):
+        """Get a string identifying the current version of a partition, or None if there is none"""
+        columnar_path = self.get_columnar_path(obs_group, varno).resolve()
+        if (columnar_path / HEADER_FILENAME).is_file():
+            return columnar_path.name
+        filepath = self.get_partition_path(obs_group, varno)
+        if filepath.is_file():
+            return _get_file_token(filepath)
+        return None
+
+    def load_stats(self, obs_group, varno, compute=True):
+        """
+        Load the per (column, vertco_type, vertco bin) aggregates of a
+        partition (see omfg.store.stats), computing and caching them under
+        the cycle's stats directory whenever they are missing or were built
+        from another version of the partition (write keeps them current).
+        Returns None if the partition does not exist, or if the aggregates
+        are not current and compute is False.
+        """
+        token = self.get_token(obs_group, varno)
+        if token is None:
+            return None
+        stats_path = self.get_stats_path(obs_group, varno)
+        meta = _read_json(stats_path.with_suffix(".json"))
+        if meta is not None and meta.get("token") == token and meta.get("version") == STATS_VERSION:
+            try:
+                return np.load(str(stats_path))
+            except (OSError, ValueError):
+                logging.info("Recomputing unreadable aggregates %s", str(stats_path))
+        if not compute:
+            return None
+        return self.update_stats(obs_group, varno, self.load(obs_group, varno), token)
+
+    def update_stats(self, obs_group, varno, partition, token):
+        """Compute and write the aggregates of a partition for the version identified by token"""
+        logging.info("Computing aggregates for %s_%s", obs_group, varno)
+        names = partition.names
+        columns = []
+        if "vertco_type@body" in names and "vertco_reference_1@body" in names:
+            columns = [name for name in STATS_COLUMNS if name in names]
+        stats = compute_stats(partition, columns)
+        self.write_stats(obs_group, varno, stats, token)
+        return stats
+
+    def write_stats(self, obs_group, varno, stats, token):
+        """Atomically write the aggregates of the partition version identified by token"""
+        stats_path = self.get_stats_path(obs_group, varno)
+        stats_path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_open(stats_path, "wb") as fh_out:
+            np.save(fh_out, stats)
+        with atomic_open(stats_path.with_suffix(".json")) as fh_out:
+            json.dump({"token": token, "version": STATS_VERSION}, fh_out)
+
+    def get_projected_path(self, obs_group, varno, projection_key):
+        """Get the Path to the cached projected x/y of a partition"""
+        return self._path / PROJECTED_DIRNAME / f"{obs_group}_{varno}.{projection_key}.npy"
+
+    def load_projected(self, obs_group, varno, projection_key):
+        """
+        Load the (rows, 2) x/y of every row of a partition projected onto the
+        map projection identified by projection_key, memory-mapped.  Returns
+        None if they are missing or were projected from another version of
+        the partition.
+        """
+        token = self.get_token(obs_group, varno)
+        projected_path = self.get_projected_path(obs_group, varno, projection_key)
+        meta = _read_json(projected_path.with_suffix(".json"))
+        if token is None or meta is None or meta.get("token") != token:
+            return None
+        try:
+            return np.load(str(projected_path), mmap_mode="r")
+        except (OSError, ValueError):
+            logging.info("Ignoring unreadable projected points %s", str(projected_path))
+            return None
+
+    def write_projected(self, obs_group, varno, projection_key, points, token):
+        """Atomically write the projected x/y of the partition version identified by token"""
+        projected_path = self.get_projected_path(obs_group, varno, projection_key)
+        projected_path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_open(projected_path, "wb") as fh_out:
+            np.save(fh_out, points)
+        with atomic_open(projected_path.with_suffix(".json")) as fh_out:
+            json.dump({"token": token}, fh_out)
+
+    def read_header(self, obs_group, varno):
+        """Read the header of a columnar partition, or None if it is not columnar"""
+        return _read_json(self.get_columnar_path(obs_group, varno) / HEADER_FILENAME)
+
+    def load(self, obs_group, varno, columns=None):
+        """
+        Load the data for the given obs group and varno as a Partition.
+        Columnar partitions are read as read-only memory-mapped arrays
+        holding only the requested columns (all columns if None), so only
+        the bytes that are used get read from disk.  Single-file partitions
+        are read as a memory-mapped structured array.
+        """
+        # resolve once so the header, index and columns all come from one version
+        columnar_path = self.get_columnar_path(obs_group, varno).resolve()
+        header = _read_json(columnar_path / HEADER_FILENAME)
+        if header is not None:
+            names = [field["name"] for field in header["fields"]]
+            if columns is None:
+                columns = names
+            for column in columns:
+                if column not in names:
+                    raise ValueError(f"No column {column} in partition {obs_group}_{varno}")
+            return Partition(
+                {
+                    column: np.load(str(columnar_path / f"{column}.npy"), mmap_mode="r")
+                    for column in columns
+                },
+                header["rows"],
+                _parse_vertco_index(_read_json(columnar_path / INDEX_FILENAME)),
+                {field["name"]: field["scale"] for field in header["fields"] if "scale" in field},
+                CellIndex.load(columnar_path / CELLS_FILENAME)[0]
+            )
+        filepath = self.get_partition_path(obs_group, varno)
+        token = _get_file_token(filepath)
+        data = np.load(str(filepath), mmap_mode="r")
+        index = _read_json(self.get_index_path(obs_group, varno))
+        if index is not None and (index.get("token") != token or _get_file_token(filepath) != token):
+            # the index belongs to a different version of the file
+            logging.info("Ignoring stale vertco index for %s", str(filepath))
+            index = None
+        cell_index, cells_token = CellIndex.load(self.get_cells_path(obs_group, varno))
+        if cell_index is not None and cells_token != token:
+            logging.info("Ignoring stale cell index for %s", str(filepath))
+            cell_index = None
+        return Partition(data, len(data), _parse_vertco_index(index), cell_index=cell_index)
+
+    def write(self, obs_group, varno, data):
+        """Write the numpy array for the given obs group and varno, with its aggregates"""
+        self._path.mkdir(parents=True, exist_ok=True)
+        data, index = sort_by_vertco(data)
+        cell_index = None
+        if "lat@hdr" in data.dtype.names and "lon@hdr" in data.dtype.names \
+                and len(data) >= MIN_INDEX_ROWS:
+            cell_index = CellIndex.build(data["lat@hdr"], data["lon@hdr"])
+        scales = {}
+        if self._schema is not None:
+            data, scales = self._schema.apply(data)
+        if self._columnar:
+            path = self._write_columnar(obs_group, varno, data, index, scales, cell_index)
+        else:
+            path = self._write_single(obs_group, varno, data, index, cell_index)
+        # keep the aggregates current, computed from the rows as they were stored
+        self.update_stats(
+            obs_group, varno, Partition(data, len(data), scales=scales), self.get_token(obs_group, varno)
+        )
+        return path
+
+    def remove(self, obs_group, varno):
+        """Remove every file belonging to the given obs group and varno"""
+        self._remove_columnar(obs_group, varno)
+        self._remove_single(obs_group, varno)
+        stats_path = self.get_stats_path(obs_group, varno)
+        for filepath in (stats_path, stats_path.with_suffix(".json")):
+            if filepath.is_file():
+                filepath.unlink()
+        for filepath in (self._path / PROJECTED_DIRNAME).glob(f"{obs_group}_{varno}.*"):
+            filepath.unlink()
+
+    def _remove_single(self, obs_group, varno):
+        """Remove the files of a single-file partition"""
+        for filepath in (
+                self.get_partition_path(obs_group, varno),
+                self.get_index_path(obs_group, varno),
+                self.get_cells_path(obs_group, varno)
+        ):
+            if filepath.is_file():
+                filepath.unlink()
+
+    def _remove_columnar(self, obs_group, varno):
+        """Remove a columnar partition's link and every version directory"""
+        columnar_path = self.get_columnar_path(obs_group, varno)
+        if columnar_path.is_symlink():
+            columnar_path.unlink()
+        elif columnar_path.is_dir():
+            shutil.rmtree(str(columnar_path))
+        for version_path in self._path.glob(f".{columnar_path.name}.*"):
+            if version_path.is_dir():
+                shutil.rmtree(str(version_path), ignore_errors=True)
+
+    def _write_single(self, obs_group, varno, data, index, cell_index):
+        """Write the partition as one structured numpy file with its vertco and cell indexes"""
+        filepath = self.get_partition_path(obs_group, varno)
+        logging.info("Writing %d rows to %s", len(data), str(filepath))
+        tmp_path = get_temp_path(filepath)
+        try:
+            with open(tmp_path, "wb") as fh_out:
+                np.save(fh_out, data)
+                fh_out.flush()
+                os.fsync(fh_out.fileno())
+            # the rename keeps the inode and mtime, so the token stays valid
+            token = _get_file_token(tmp_path)
+            index_path = self.get_index_path(obs_group, varno)
+            if index is None:
+                if index_path.is_file():
+                    index_path.unlink()
+            else:
+                with atomic_open(index_path) as fh_out:
+                    json.dump({"token": token, "vertco": index}, fh_out)
+            cells_path = self.get_cells_path(obs_group, varno)
+            if cell_index is None:
+                if cells_path.is_file():
+                    cells_path.unlink()
+            else:
+                with atomic_open(cells_path, "wb") as fh_out:
+                    cell_index.save(fh_out, token)
+            os.replace(str(tmp_path), str(filepath))
+            # a columnar version of the partition would be read before this file
+            self._remove_columnar(obs_group, varno)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        return filepath
+
+    def _write_columnar(self, obs_group, varno, data, index, scales, cell_index):
+        """Write one numpy file per field into a new version and swap it in"""
+        columnar_path = self.get_columnar_path(obs_group, varno)
+        logging.info("Writing %d rows to %s", len(data), str(columnar_path))
+        version_path = self._path / f".{columnar_path.name}.{uuid4().hex}"
+        version_path.mkdir()
+        for name in data.dtype.names:
+            np.save(str(version_path / f"{name}.npy"), np.ascontiguousarray(data[name]))
+        if index is not None:
+            with open(version_path / INDEX_FILENAME, "w") as fh_out:
+                json.dump({"vertco": index}, fh_out)
+        if cell_index is not None:
+            with open(version_path / CELLS_FILENAME, "wb") as fh_out:
+                cell_index.save(fh_out)
+        fields = []
+        for name in data.dtype.names:
+            field = {"name": name, "dtype": data.dtype[name].str}
+            if name in scales:
+                field["scale"] = scales[name]
+            fields.append(field)
+        header = {"rows": len(data), "fields": fields}
+        with open(version_path / HEADER_FILENAME, "w") as fh_out:
+            json.dump(header, fh_out, indent=2)
+        old_version_path = None
+        if columnar_path.is_symlink():
+            old_version_path = columnar_path.resolve()
+        elif columnar_path.is_dir():
+            # a directory written before partitions were versioned
+            shutil.rmtree(str(columnar_path))
+        link_path = get_temp_path(columnar_path)
+        os.symlink(version_path.name, str(link_path))
+        os.replace(str(link_path), str(columnar_path))
+        # the files of a single-file version of the partition are stale now
+        self._remove_single(obs_group, varno)
+        # keep the replaced version for readers that already resolved it
+        for stale_path in self._path.glob(f".{columnar_path.name}.*"):
+            if stale_path.is_dir() and stale_path not in (version_path, old_version_path):
+                shutil.rmtree(str(stale_path), ignore_errors=True)
+        return columnar_path
+
+
+def find_cycles(data_path, start_cycle, end_cycle):
+    """Get the sorted cycle directories in a data path from start_cycle to end_cycle"""
+    start_cycle, end_cycle = str(start_cycle), str(end_cycle)
+    return sorted(
+        path.name for path in Path(data_path).iterdir()
+        if path.is_dir() and path.name.isdigit() and len(path.name) == len(end_cycle)
+        and start_cycle <= path.name <= end_cycle
+    )
+
+
+def _get_file_token(filepath):
+    """Get a string identifying this version of a file"""
+    stat = os.stat(str(filepath))
+    return f"{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _parse_vertco_index(index):
+    """Convert the JSON vertco index into a dict keyed by integer vertco type"""
+    if index is None:
+        return None
+    return {int(key): value for key, value in index["vertco"].items()}
+
+
+def _read_json(filepath):
+    """Read a JSON file, or return None if it does not exist"""
+    try:
+        with open(filepath, "r") as fh_in:
+            return json.load(fh_in)
+    except FileNotFoundError:
+        return None
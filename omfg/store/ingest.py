@@ -0,0 +1,192 @@
+"""Parallel, incremental ingest of many ODB2 files into a per-cycle store"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from tempfile import mkdtemp
+from uuid import uuid4
+import logging
+import shutil
+import time
+import numpy as np
+from omfg.wrappers.odb import ODB, DEFAULT_CHUNK_SIZE
+from .manifest import Manifest
+from .partition import split_partitions
+
+
+def find_odb_files(paths, pattern="*.odb"):
+    """Expand a list of files and directories into a list of ODB2 file paths"""
+    filenames = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            filenames.extend(sorted(str(child) for child in path.glob(pattern) if child.is_file()))
+        else:
+            filenames.append(str(path))
+    return filenames
+
+
+def ingest_files(filenames, store, workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 fields=None, varno=None, force=False, query=None):
+    """
+    Read the ODB2 files with a pool of worker processes and write their
+    partitions to the store.
+
+    The cycle manifest records each source file's size, mtime, hash, the
+    fields and SQL used (from varno and fields, or the given Query), and
+    the partitions it produced.  Files that match their record are skipped
+    unless force is set, and only the partitions touched by new, changed
+    or deleted files are rebuilt.  Any unchanged file that also contributes
+    to those partitions is re-read.
+    Workers save each file's partitions as fragments in a hidden directory
+    of the store rather than sending them back, so the parent only holds
+    one partition at a time while it merges them.  Partitions found in
+    more than one file are concatenated in filename order, so the output
+    does not depend on which worker finishes first.
+    A file that fails to read is logged and reported, and it stays out of
+    the manifest so the next run retries it.  The partitions it was
+    recorded in are kept as they are rather than rebuilt without its rows,
+    and the other files in them are not recorded either.  Returns one
+    report dict per file, in filename order.
+    """
+    filenames = sorted({str(Path(filename).resolve()) for filename in filenames})
+    query = ODB.build_query(varno, fields, query)
+    settings = {"fields": query.fields, "sql": query.sql}
+    manifest = Manifest.load(store.path)
+    reports = {}
+    changed = []
+    for filename in filenames:
+        if not force and Path(filename).is_file() and manifest.is_unchanged(filename, settings):
+            logging.info("Skipping unchanged file %s", filename)
+            reports[filename] = _report(filename, "SKIP")
+        else:
+            changed.append(filename)
+    removed = [
+        filename for filename in manifest.filenames
+        if filename not in filenames and not Path(filename).is_file()
+    ]
+    store.path.mkdir(parents=True, exist_ok=True)
+    fragment_path = mkdtemp(prefix=".ingest.", dir=str(store.path))
+    try:
+        file_partitions = {}
+        failed = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            changed_results = _read_files(executor, changed, chunk_size, query, fragment_path)
+            for filename, result in changed_results:
+                if isinstance(result, Exception):
+                    reports[filename] = _report(filename, "FAIL", error=str(result))
+                    failed.append(filename)
+                    continue
+                rows, seconds, file_partitions[filename] = result
+                reports[filename] = _report(filename, "OK", rows=rows, seconds=seconds)
+
+            affected = set()
+            for filename in removed:
+                affected |= manifest.get_partitions(filename)
+            for filename, partitions in file_partitions.items():
+                affected |= manifest.get_partitions(filename)
+                affected |= {(obs_group, varno) for obs_group, varno, _ in partitions}
+            contributors = [
+                filename for filename in manifest.filenames
+                if filename not in changed and filename not in removed
+                and manifest.get_partitions(filename) & affected
+            ]
+            blocked = set()
+            for filename in failed:
+                # its old rows are still in these partitions and can not be replaced
+                blocked |= manifest.get_partitions(filename) & affected
+            contributor_results = _read_files(
+                executor, contributors, chunk_size, query, fragment_path
+            )
+            for filename, result in contributor_results:
+                if isinstance(result, Exception):
+                    # without this file these partitions can not be rebuilt correctly
+                    blocked |= manifest.get_partitions(filename) & affected
+                    continue
+                file_partitions[filename] = [
+                    partition for partition in result[2] if partition[:2] in affected
+                ]
+
+        if blocked:
+            logging.error("Not rebuilding %d partitions with unreadable sources", len(blocked))
+        _write_partitions(store, file_partitions, affected - blocked)
+    finally:
+        shutil.rmtree(fragment_path, ignore_errors=True)
+    for filename in changed:
+        if filename not in file_partitions:
+            continue
+        partitions = {(obs_group, varno) for obs_group, varno, _ in file_partitions[filename]}
+        if partitions & blocked:
+            continue
+        manifest.record(filename, settings, partitions)
+    for filename in removed:
+        manifest.remove(filename)
+    manifest.save()
+    return [reports[filename] for filename in filenames]
+
+
+def _read_files(executor, filenames, chunk_size, query, fragment_path):
+    """Read the files in the pool, yielding (filename, result or exception) as they finish"""
+    futures = {
+        executor.submit(_read_partitions, filename, chunk_size, query, fragment_path): filename
+        for filename in filenames
+    }
+    for done, future in enumerate(as_completed(futures), start=1):
+        filename = futures[future]
+        try:
+            result = future.result()
+        except Exception as err:
+            logging.error("[%d/%d] Failed to read %s: %s", done, len(filenames), filename, err)
+            yield filename, err
+            continue
+        rows, seconds, _ = result
+        logging.info(
+            "[%d/%d] Read %d rows from %s in %.2fs (%.0f rows/s)",
+            done, len(filenames), rows, filename, seconds, rows / max(seconds, 1e-9)
+        )
+        yield filename, result
+
+
+def _read_partitions(filename, chunk_size, query, fragment_path):
+    """
+    Worker task: read one ODB2 file, split it into partitions and save each
+    as a fragment, returning the (obs_group, varno, fragment) of each
+    """
+    start_time = time.perf_counter()
+    data = ODB(filename, chunk_size=chunk_size, query=query).data
+    file_path = Path(fragment_path) / uuid4().hex
+    file_path.mkdir()
+    partitions = []
+    for obs_group, varno, partition in split_partitions(data):
+        partition_path = file_path / f"{obs_group}_{varno}.npy"
+        np.save(str(partition_path), partition)
+        partitions.append((obs_group, varno, str(partition_path)))
+    return len(data), time.perf_counter() - start_time, partitions
+
+
+def _report(filename, status, rows=0, seconds=0.0, error=None):
+    """Build the report dict for a single file"""
+    return {
+        "filename": filename,
+        "status": status,
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds > 0 else 0.0,
+        "error": error
+    }
+
+
+def _write_partitions(store, file_partitions, affected):
+    """Merge the fragments of each affected partition in filename order and write them"""
+    merged = {}
+    for filename in sorted(file_partitions):
+        for obs_group, varno, partition_path in file_partitions[filename]:
+            if (obs_group, varno) in affected:
+                merged.setdefault((obs_group, varno), []).append(partition_path)
+    for obs_group, varno in sorted(affected):
+        partition_paths = merged.get((obs_group, varno))
+        if partition_paths is None:
+            logging.info("Removing empty partition %s_%s", obs_group, varno)
+            store.remove(obs_group, varno)
+            continue
+        # only this partition's rows are read into memory
+        arrays = [np.load(partition_path, mmap_mode="r") for partition_path in partition_paths]
+        store.write(obs_group, varno, np.concatenate(arrays))
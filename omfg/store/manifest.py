@@ -0,0 +1,90 @@
+"""Per-cycle record of the ingested source files"""
+
+from pathlib import Path
+import hashlib
+import json
+import os
+from omfg.util import atomic_open
+
+MANIFEST_FILENAME = "manifest.json"
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+class Manifest:
+    """
+    Record of every source file ingested into a cycle: its size, mtime and
+    content hash, the settings (fields and filter) it was read with, and the
+    (obs_group, varno) partitions it produced.
+    """
+    def __init__(self, path, entries=None):
+        self._path = Path(path)
+        self._entries = {} if entries is None else entries
+
+    @property
+    def filenames(self):
+        """Get a sorted list of the recorded source files"""
+        return sorted(self._entries)
+
+    @staticmethod
+    def load(cycle_path):
+        """Load the manifest from a cycle directory, or start an empty one"""
+        path = Path(cycle_path) / MANIFEST_FILENAME
+        try:
+            with open(path, "r") as fh_in:
+                return Manifest(path, json.load(fh_in)["files"])
+        except FileNotFoundError:
+            return Manifest(path)
+
+    def save(self):
+        """Atomically write the manifest"""
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_open(self._path) as fh_out:
+            json.dump({"files": self._entries}, fh_out, indent=2, sort_keys=True)
+
+    def get_partitions(self, filename):
+        """Get the set of (obs_group, varno) partitions produced by a source file"""
+        entry = self._entries.get(filename)
+        if entry is None:
+            return set()
+        return {(obs_group, int(varno)) for obs_group, varno in entry["partitions"]}
+
+    def is_unchanged(self, filename, settings):
+        """
+        Check whether a source file matches its record.  The hash is only
+        computed when the size or mtime differ, and if the content turns out
+        to be the same the recorded size and mtime are refreshed.
+        """
+        entry = self._entries.get(filename)
+        if entry is None or entry["settings"] != settings:
+            return False
+        stat = os.stat(filename)
+        if stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+        if stat.st_size != entry["size"] or hash_file(filename) != entry["hash"]:
+            return False
+        entry["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+    def record(self, filename, settings, partitions):
+        """Record a source file that has just been ingested"""
+        stat = os.stat(filename)
+        self._entries[filename] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": hash_file(filename),
+            "settings": settings,
+            "partitions": sorted([obs_group, int(varno)] for obs_group, varno in partitions)
+        }
+
+    def remove(self, filename):
+        """Forget a source file"""
+        self._entries.pop(filename, None)
+
+
+def hash_file(filename):
+    """Get the SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as fh_in:
+        for block in iter(lambda: fh_in.read(_HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
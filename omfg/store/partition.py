@@ -0,0 +1,64 @@
+"""Partition ODB data by obs group and varno"""
+
+import numpy as np
+from omfg.constants import Subtype
+
+
+def get_obs_group(obstype):
+    """Get the obs group name for an ops_obstype code, falling back to the code"""
+    obs_group = Subtype.get_name(int(obstype))
+    if obs_group is None:
+        return str(int(obstype))
+    return obs_group
+
+
+def split_partitions(data):
+    """
+    Partition a structured array by obs group and varno using a single
+    stable argsort on a combined (ops_obstype, varno) key.  Yields
+    (obs_group, varno, partition) tuples, with rows in their original
+    order within each partition.
+    """
+    if len(data) == 0:
+        return
+    keys = data["ops_obstype@hdr"].astype(np.int64) << 32
+    keys |= data["varno@body"].astype(np.uint32)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    bounds = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+    starts = np.concatenate(([0], bounds))
+    stops = np.concatenate((bounds, [len(sorted_keys)]))
+    for start, stop in zip(starts, stops):
+        key = int(sorted_keys[start])
+        yield get_obs_group(key >> 32), key & 0xFFFFFFFF, data[order[start:stop]]
+
+
+def sort_by_vertco(data, return_order=False):
+    """
+    Stably sort a partition by vertco_type and vertco_reference_1, with the
+    rows that have no vertco_reference_1 kept at the end of each vertco
+    type.  Returns the sorted array and an index mapping each vertco type
+    to its [start, nan_start, stop) row offsets, or None for the index if
+    the partition has no vertco fields.  With return_order, the sort
+    permutation is returned in place of the sorted array so callers can
+    gather the rows in blocks.
+    """
+    if "vertco_type@body" not in data.dtype.names or \
+            "vertco_reference_1@body" not in data.dtype.names:
+        if return_order:
+            return np.arange(len(data)), None
+        return data, None
+    # lexsort sorts on the last key first and places NaN after every number
+    order = np.lexsort((data["vertco_reference_1@body"], data["vertco_type@body"]))
+    vertco_types = data["vertco_type@body"][order]
+    references = data["vertco_reference_1@body"][order]
+    bounds = np.flatnonzero(vertco_types[1:] != vertco_types[:-1]) + 1
+    starts = np.concatenate(([0], bounds))
+    stops = np.concatenate((bounds, [len(data)]))
+    index = {}
+    for start, stop in zip(starts[:len(data)], stops):
+        nan_start = int(start + np.searchsorted(references[start:stop], np.nan))
+        index[int(vertco_types[start])] = [int(start), nan_start, int(stop)]
+    if return_order:
+        return order, index
+    return data[order], index
@@ -0,0 +1,115 @@
+"""Compact storage types for partitions, with precision checks on the downcast"""
+
+import logging
+import numpy as np
+
+COMPACT_TYPES = {
+    "lat@hdr": "f4",
+    "lon@hdr": "f4",
+    "report_status@hdr": "i2",
+    "an_depar@body": "f4",
+    "corvalue@body": "f4",
+    "fg_depar@body": "f4",
+    "obsvalue@body": "f4",
+    "ops_obstype@hdr": "i4",
+    "vertco_reference_1@body": "f4",
+    "vertco_reference_2@body": "f4",
+    "vertco_type@body": "i2",
+    "varno@body": "i2"
+}
+
+# lat/lon stored as int16 hundredths of a degree when quantized
+LATLON_SCALE = 0.01
+DEFAULT_ATOL = 1e-6
+
+
+class CompactSchema:
+    """
+    Opt-in schema that stores floats as f4 and codes as small integers,
+    optionally quantizing lat/lon to int16 hundredths of a degree.  Every
+    downcast field is checked against |original - stored| <= atol + rtol *
+    |original|, where atol is a dict of per-field bounds defaulting to
+    DEFAULT_ATOL, with NaN required to stay NaN and integers required to
+    round-trip exactly.  A field that fails the check either raises a
+    ValueError (on_error="fail") or keeps its original type
+    (on_error="fallback").
+    """
+    def __init__(self, types=None, rtol=1e-6, atol=None, quantize_latlon=False, on_error="fail"):
+        if on_error not in ("fail", "fallback"):
+            raise ValueError(f"Unknown on_error mode: {on_error}")
+        self._types = dict(COMPACT_TYPES if types is None else types)
+        self._rtol = rtol
+        self._atol = {} if atol is None else dict(atol)
+        self._quantize_latlon = quantize_latlon
+        self._on_error = on_error
+        if quantize_latlon:
+            for name in ("lat@hdr", "lon@hdr"):
+                self._types[name] = "i2"
+                self._atol.setdefault(name, LATLON_SCALE / 2)
+
+    @property
+    def quantize_latlon(self):
+        """Whether lat/lon are stored as scaled integers"""
+        return self._quantize_latlon
+
+    def apply(self, data):
+        """
+        Downcast a structured array.  Returns the compact array and a dict
+        of field name to scale for the fields stored as scaled integers.
+        """
+        dtype = []
+        columns = {}
+        scales = {}
+        for name in data.dtype.names:
+            column = data[name]
+            compact_type = self._types.get(name)
+            scale = LATLON_SCALE if self._quantize_latlon and name in ("lat@hdr", "lon@hdr") else None
+            if compact_type is not None and np.dtype(compact_type) != column.dtype:
+                compact = self._downcast(name, column, np.dtype(compact_type), scale)
+                if compact is not None:
+                    column = compact
+                    if scale is not None:
+                        scales[name] = scale
+            dtype.append((name, column.dtype))
+            columns[name] = column
+        compact_data = np.empty(len(data), dtype=dtype)
+        for name, column in columns.items():
+            compact_data[name] = column
+        return compact_data, scales
+
+    def _downcast(self, name, column, compact_type, scale):
+        """Downcast one column, or return None if it falls back to its original type"""
+        if scale is not None:
+            with np.errstate(invalid="ignore"):
+                scaled = np.round(column / scale)
+            info = np.iinfo(compact_type)
+            valid = np.isfinite(scaled).all() and (scaled >= info.min).all() and (scaled <= info.max).all()
+            compact = scaled.astype(compact_type) if valid else None
+            restored = None if compact is None else compact * scale
+        elif compact_type.kind in "iu":
+            info = np.iinfo(compact_type)
+            valid = (column >= info.min).all() and (column <= info.max).all()
+            compact = column.astype(compact_type) if valid else None
+            restored = compact
+        else:
+            with np.errstate(over="ignore", invalid="ignore"):
+                compact = column.astype(compact_type)
+            restored = compact
+        if restored is not None and self._within_tolerance(name, column, restored):
+            return compact
+        message = f"Downcasting {name} to {compact_type} exceeds the configured error bounds"
+        if self._on_error == "fail":
+            raise ValueError(message)
+        logging.warning("%s, keeping %s", message, column.dtype)
+        return None
+
+    def _within_tolerance(self, name, original, restored):
+        """Check the restored values against the original values"""
+        if original.dtype.kind in "iu":
+            return np.array_equal(original, restored)
+        original_nan = np.isnan(original)
+        if not np.array_equal(original_nan, np.isnan(restored)):
+            return False
+        error = np.abs(original[~original_nan] - restored[~original_nan].astype(original.dtype))
+        bound = self._atol.get(name, DEFAULT_ATOL) + self._rtol * np.abs(original[~original_nan])
+        return bool((error <= bound).all())
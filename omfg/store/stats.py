@@ -0,0 +1,176 @@
+"""Compact, mergeable per-cycle aggregates of the value and departure columns"""
+
+import numpy as np
+
+# bump this whenever the layout or binning of the aggregates changes
+STATS_VERSION = 2
+
+STATS_COLUMNS = ("obsvalue@body", "corvalue@body", "fg_depar@body", "an_depar@body")
+
+STATS_DTYPE = np.dtype([
+    ("column", "U16"),
+    ("vertco_type", "i4"),
+    ("bin", "i8"),
+    ("count", "i8"),
+    ("mean", "f8"),
+    ("m2", "f8"),
+    ("min", "f8"),
+    ("max", "f8")
+])
+
+# width of the vertco_reference_1 bins for each vertco type, in its units
+VERTCO_BIN_WIDTHS = {
+    1: 1000.0,  # pressure (Pa)
+    2: 100.0,  # geopotential height (m)
+    6: 100.0,  # impact parameter (m)
+    10: 10.0,  # ocean depth (m)
+    11: 1000.0,  # derived pressure (Pa)
+    13: 100.0,  # tangent height (m)
+    14: 1000.0,  # model level pressure (Pa)
+    15: 100.0  # lidar range (m)
+}
+DEFAULT_BIN_WIDTH = 1.0
+
+
+def get_bins(vertco_types, references):
+    """
+    Get the vertco bin of each row.  A reference exactly on a multiple k of
+    its type's bin width goes in bin 2k, and one strictly between k and k+1
+    widths goes in bin 2k+1, so any range whose ends are multiples of the
+    width is covered by whole bins.
+    """
+    vertco_types = np.asarray(vertco_types)
+    widths = np.full(len(vertco_types), DEFAULT_BIN_WIDTH)
+    for vertco_type, width in VERTCO_BIN_WIDTHS.items():
+        widths[vertco_types == vertco_type] = width
+    steps = np.asarray(references, dtype=np.float64) / widths
+    edges = np.floor(steps)
+    return (2 * edges + (steps != edges)).astype(np.int64)
+
+
+def is_exact_range(vertco_type, vertco_min, vertco_max):
+    """Check whether the bins selected for a vertco range hold exactly the obs within it"""
+    bin_min, bin_max = get_bins([int(vertco_type)] * 2, [float(vertco_min), float(vertco_max)])
+    return bool(bin_min % 2 == 0 and bin_max % 2 == 0)
+
+
+def compute_stats(partition, columns):
+    """
+    Compute the count, mean, M2 (sum of squared deviations from the mean),
+    min and max of each column for every (vertco_type, vertco bin) group
+    of a partition, skipping rows whose value or vertco_reference_1 is
+    missing.  Returns a STATS_DTYPE array sorted by column, vertco_type and
+    bin.  The groups are found with one sort and reduced with reduceat, and
+    M2 is a second pass over the deviations so it keeps full precision.
+    """
+    if not columns:
+        return np.empty(0, dtype=STATS_DTYPE)
+    vertco_types = np.asarray(partition["vertco_type@body"])
+    references = np.asarray(partition["vertco_reference_1@body"], dtype=np.float64)
+    has_vertco = ~np.isnan(references)
+    bins = np.zeros(len(references), dtype=np.int64)
+    bins[has_vertco] = get_bins(vertco_types[has_vertco], references[has_vertco])
+    results = []
+    for column in columns:
+        values = np.asarray(partition[column], dtype=np.float64)
+        rows = np.flatnonzero(has_vertco & ~np.isnan(values))
+        if len(rows) == 0:
+            continue
+        order = rows[np.lexsort((bins[rows], vertco_types[rows]))]
+        group_types, group_bins, group_values = vertco_types[order], bins[order], values[order]
+        changes = (group_types[1:] != group_types[:-1]) | (group_bins[1:] != group_bins[:-1])
+        starts = np.concatenate(([0], np.flatnonzero(changes) + 1))
+        counts = np.diff(np.concatenate((starts, [len(order)])))
+        means = np.add.reduceat(group_values, starts) / counts
+        deviations = group_values - np.repeat(means, counts)
+        stats = np.empty(len(starts), dtype=STATS_DTYPE)
+        stats["column"] = column
+        stats["vertco_type"] = group_types[starts]
+        stats["bin"] = group_bins[starts]
+        stats["count"] = counts
+        stats["mean"] = means
+        stats["m2"] = np.add.reduceat(deviations * deviations, starts)
+        stats["min"] = np.minimum.reduceat(group_values, starts)
+        stats["max"] = np.maximum.reduceat(group_values, starts)
+        results.append(stats)
+    if not results:
+        return np.empty(0, dtype=STATS_DTYPE)
+    return np.concatenate(results)
+
+
+def select_stats(stats, column, vertco_type, vertco_min, vertco_max):
+    """
+    Get the rows of a stats array for a column and the vertco bins that
+    overlap [vertco_min, vertco_max], so a range resolves to whole bins
+    (exactly, when is_exact_range)
+    """
+    bin_min, bin_max = get_bins([int(vertco_type)] * 2, [float(vertco_min), float(vertco_max)])
+    condition = (stats["column"] == column) & (stats["vertco_type"] == int(vertco_type))
+    condition &= (stats["bin"] >= bin_min) & (stats["bin"] <= bin_max)
+    return stats[condition]
+
+
+def combine_stats(arrays):
+    """
+    Combine stats arrays, for example from several cycles, into one where
+    the rows sharing a column, vertco_type and bin are merged with Chan's
+    parallel formula
+    """
+    stats = np.concatenate(arrays) if arrays else np.empty(0, dtype=STATS_DTYPE)
+    if len(stats) == 0:
+        return stats
+    stats = stats[np.lexsort((stats["bin"], stats["vertco_type"], stats["column"]))]
+    changes = (stats["column"][1:] != stats["column"][:-1])
+    changes |= (stats["vertco_type"][1:] != stats["vertco_type"][:-1])
+    changes |= (stats["bin"][1:] != stats["bin"][:-1])
+    starts = np.concatenate(([0], np.flatnonzero(changes) + 1))
+    sizes = np.diff(np.append(starts, len(stats)))
+    counts = np.add.reduceat(stats["count"], starts)
+    means = np.add.reduceat(stats["count"] * stats["mean"], starts) / counts
+    spread = stats["count"] * (stats["mean"] - np.repeat(means, sizes)) ** 2
+    combined = stats[starts].copy()
+    combined["count"] = counts
+    combined["mean"] = means
+    combined["m2"] = np.add.reduceat(stats["m2"] + spread, starts)
+    combined["min"] = np.minimum.reduceat(stats["min"], starts)
+    combined["max"] = np.maximum.reduceat(stats["max"], starts)
+    return combined
+
+
+def merge_stats(stats):
+    """
+    Merge the rows of a stats array into a single (count, mean, std, min,
+    max) tuple, combining the moments with Chan's parallel formula.  An
+    empty array gives a count of 0 and NaN for the rest.
+    """
+    count = int(stats["count"].sum())
+    if count == 0:
+        return 0, np.nan, np.nan, np.nan, np.nan
+    mean = float((stats["count"] * stats["mean"]).sum() / count)
+    m2 = float((stats["m2"] + stats["count"] * (stats["mean"] - mean) ** 2).sum())
+    return (
+        count, mean, float(np.sqrt(m2 / count)), float(stats["min"].min()), float(stats["max"].max())
+    )
+
+
+def query_stats(stores, obs_group, varno, column, vertco_type, vertco_min, vertco_max):
+    """
+    Get the count, mean, std, min and max of a column over a vertco range
+    and any number of cycles (CycleStores) by merging their aggregates, so
+    no raw obs are read.  The dict's exact flag says whether the range is
+    covered exactly by whole bins.
+    """
+    selected = []
+    for store in stores:
+        stats = store.load_stats(obs_group, varno)
+        if stats is not None:
+            selected.append(select_stats(stats, column, vertco_type, vertco_min, vertco_max))
+    count, mean, std, value_min, value_max = merge_stats(combine_stats(selected))
+    return {
+        "count": count,
+        "mean": mean,
+        "std": std,
+        "min": value_min,
+        "max": value_max,
+        "exact": is_exact_range(vertco_type, vertco_min, vertco_max)
+    }
@@ -1,6 +1,10 @@
 """Utility module"""
 
+from contextlib import contextmanager
+from pathlib import Path
+from uuid import uuid4
 import logging
+import os
 
 
 def init_logging(level=logging.INFO):
@@ -10,3 +14,29 @@ def init_logging(level=logging.INFO):
         format="%(asctime)s | %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S"
     )
+
+
+def get_temp_path(path):
+    """Get a unique hidden Path next to path for writing before a rename"""
+    path = Path(path)
+    return path.with_name(f".{path.name}.{uuid4().hex}.tmp")
+
+
+@contextmanager
+def atomic_open(path, mode="w"):
+    """
+    Open a temporary file next to path for writing, and move it over path
+    only once it has been completely written, so readers never see a
+    partially written file.
+    """
+    tmp_path = get_temp_path(path)
+    try:
+        with open(tmp_path, mode) as fh_out:
+            yield fh_out
+            fh_out.flush()
+            os.fsync(fh_out.fileno())
+        os.replace(str(tmp_path), str(path))
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
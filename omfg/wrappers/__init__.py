@@ -1,7 +1,9 @@
 """Wrappers for various file types"""
 
 from .odb import ODB
+from .query import Query
 
 __all__ = [
-    "ODB"
+    "ODB",
+    "Query"
 ]
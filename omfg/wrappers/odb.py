@@ -1,73 +1,206 @@
 import logging
 import numpy as np
-from netCDF4 import Dataset
-from py3odb import Reader
+from .query import FIELD_TYPES, Query
 
 
-_DEFAULT_FIELDS = {
-    "lat@hdr": "f8",
-    "lon@hdr": "f8",
-    "report_status@hdr": "i4",
-    "an_depar@body": "f8",
-    "corvalue@body": "f8",
-    "fg_depar@body": "f8",
-    "obsvalue@body": "f8",
-    "ops_obstype@hdr": "i4",
-    "vertco_reference_1@body": "f8",
-    "vertco_reference_2@body": "f8",
-    "vertco_type@body": "i4"
-}
+_DEFAULT_FIELDS = FIELD_TYPES
+
+DEFAULT_CHUNK_SIZE = 65536
+DEFAULT_NC_CHUNK_SIZE = 16384
 
 
 class ODB:
     """
     Object wrapper around the relevant data contained in an odb2 file.
     If you do not specify a varno, all varnos will be extracted.  The
-    fields                                                                
+    fields map each ODB column name to the numpy type it is stored as.
+    Rows are streamed chunk_size at a time into one array that grows by
+    half whenever it fills and is trimmed to the rows read, so besides the
+    final array the peak holds at most half of it in spare rows, or the old
+    buffer while a grow has to move it.  A Query can be
+    given instead of varno and fields to push a projection and predicates
+    into the ODB SQL.
+
+    The first time varnos are looked up, the rows are stably reordered by
+    varno and the start/stop offset of each varno is recorded, so each
+    varno is then a contiguous slice.  The index itself holds two offsets
+    per distinct varno; building it needs a permutation array of 8 bytes
+    per row and one copy of the data while the rows are reordered.
     """
-    def __init__(self, filename, varno=None, fields=None):
-        if fields is None:
-            fields = _DEFAULT_FIELDS
-        self._data = self._read_odb(filename, varno, fields)
+    def __init__(self, filename, varno=None, fields=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 query=None):
+        self._data = self._read_odb(filename, self.build_query(varno, fields, query), chunk_size)
+        self._varnos = None
+        self._varno_offsets = None
+
+    @property
+    def data(self):
+        """The structured numpy array of every extracted row"""
+        return self._data
 
     @property
     def varnos(self):
-        """Get an array of varnos"""
-        return np.unique(self._data["varno@body"])
+        """Get a sorted array of varnos"""
+        if self._varnos is None:
+            self._build_varno_index()
+        return self._varnos
 
     def get_varno_data(self, varno):
-        """Get a numpy array subset for the given varno"""
+        """Get a numpy array subset for the given varno (a view of the data)"""
         return self._data[self._get_varno_index(varno)]
 
     def save_netcdf(self, varno, filename):
         """Generate a netCDF4 file for the given varno"""
+        self.export_netcdf(filename, varnos=[varno])
+
+    def export_netcdf(self, filename, varnos=None, chunk_size=DEFAULT_NC_CHUNK_SIZE,
+                      complevel=4, shuffle=True, block_size=DEFAULT_CHUNK_SIZE):
+        """
+        Generate a netCDF4 file holding every varno (or the given varnos) in
+        a single pass over the data.  Each varno is a group, varno_<code>,
+        with a fixed size record dimension.  Its rows are sorted by
+        vertco_type and vertco_reference_1 and written in blocks of
+        block_size rows, so memory use is bounded by the block size rather
+        than the varno size.  Variables are compressed in chunks of
+        chunk_size records with the given zlib level and shuffle filter,
+        and the vertco_index_* variables give the [start, nan_start, stop)
+        records of each vertco type.  A reader can therefore pull one varno
+        or level range without decompressing the rest.
+        """
+        # imported here because omfg.store imports this module, and netCDF4
+        # is only needed for exports
+        from netCDF4 import Dataset
+        from omfg.store.partition import sort_by_vertco
         logging.info("Saving netCDF4 file")
-        varno_data = self.get_varno_data(varno)
+        if varnos is None:
+            varnos = self.varnos
+        names = [name for name in self._data.dtype.names if name != "varno@body"]
         nc_data = Dataset(filename, "w")
-        nc_data.createDimension("record", None)
-        for name, dtype in _FIELDS.items():
-            variable = nc_data.createVariable(name, dtype, "record", zlib=True)
-            variable[:] = varno_data[name]
-        nc_data.close()
+        try:
+            nc_data.setncattr("varnos", np.array(varnos, dtype="i4"))
+            for varno in varnos:
+                varno_data = self.get_varno_data(varno)
+                if len(varno_data) == 0:
+                    logging.info("No data for varno %s", varno)
+                    continue
+                logging.info("Writing %d rows for varno %s", len(varno_data), varno)
+                order, vertco_index = sort_by_vertco(varno_data, return_order=True)
+                group = nc_data.createGroup(f"varno_{varno}")
+                group.setncattr("varno", int(varno))
+                group.createDimension("record", len(varno_data))
+                variables = {
+                    name: group.createVariable(
+                        name,
+                        varno_data.dtype[name],
+                        ("record",),
+                        zlib=complevel > 0,
+                        complevel=complevel,
+                        shuffle=shuffle,
+                        chunksizes=(min(chunk_size, len(varno_data)),)
+                    )
+                    for name in names
+                }
+                for start in range(0, len(varno_data), block_size):
+                    block = varno_data[order[start:start + block_size]]
+                    for name, variable in variables.items():
+                        variable[start:start + len(block)] = block[name]
+                if vertco_index is not None:
+                    self._write_vertco_index(group, vertco_index)
+        finally:
+            nc_data.close()
+
+    @staticmethod
+    def _write_vertco_index(group, vertco_index):
+        """Write the record offsets of each vertco type to a netCDF group"""
+        group.createDimension("vertco_type", len(vertco_index))
+        offsets = np.array(
+            [[vertco_type] + offsets for vertco_type, offsets in sorted(vertco_index.items())],
+            dtype="i8"
+        )
+        for column, name in enumerate(("type", "start", "nan_start", "stop")):
+            variable = group.createVariable(f"vertco_index_{name}", "i8", ("vertco_type",))
+            variable[:] = offsets[:, column]
+
+    @classmethod
+    def iter_chunks(cls, filename, varno=None, fields=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                    query=None):
+        """
+        Read the database and yield numpy arrays of at most chunk_size rows
+        as they are filled, so processing can start before the whole file
+        has been read.
+        """
+        # imported here so the store and charts load without the ODB API
+        from py3odb import Reader
+        if chunk_size < 1:
+            raise ValueError(f"Invalid chunk size: {chunk_size}")
+        query = cls.build_query(varno, fields, query)
+        dtype = cls._build_dtype(query.fields)
+        chunk = np.empty(chunk_size, dtype=dtype)
+        count = 0
+        logging.info("Running query: %s", query.sql)
+        with Reader(filename, query.sql) as odb_reader:
+            for row in odb_reader:
+                chunk[count] = tuple(row)
+                count += 1
+                if count == chunk_size:
+                    yield chunk
+                    chunk = np.empty(chunk_size, dtype=dtype)
+                    count = 0
+        if count > 0:
+            # copy so the unused tail of the buffer can be released
+            yield chunk[:count].copy()
 
     @staticmethod
     def _build_dtype(fields):
         """Build a numpy dtype from the fields"""
         return np.dtype(list(fields.items()))
 
+    def _build_varno_index(self):
+        """Reorder the data by varno and record the offsets of each varno"""
+        logging.info("Building varno index")
+        order = np.argsort(self._data["varno@body"], kind="stable")
+        self._data = self._data[order]
+        del order
+        varno_column = self._data["varno@body"]
+        bounds = np.flatnonzero(varno_column[1:] != varno_column[:-1]) + 1
+        starts = np.concatenate(([0], bounds))
+        stops = np.concatenate((bounds, [len(varno_column)]))
+        self._varnos = varno_column[starts[:len(varno_column)]].copy()
+        self._varno_offsets = {
+            int(varno): (int(start), int(stop))
+            for varno, start, stop in zip(self._varnos, starts, stops)
+        }
+
     def _get_varno_index(self, varno):
-        """Get the numpy index to the referenced varno"""
-        return np.where(self._data["varno@body"] == varno)
+        """Get the slice of the data holding the referenced varno"""
+        if self._varno_offsets is None:
+            self._build_varno_index()
+        start, stop = self._varno_offsets.get(int(varno), (0, 0))
+        return slice(start, stop)
 
-    def _read_odb(self, filename, varno, fields):
+    @staticmethod
+    def build_query(varno, fields, query):
+        """Build the query from the varno and fields unless one was given"""
+        if query is not None:
+            if varno is not None or fields is not None:
+                raise ValueError("Give either a query or a varno and fields, not both")
+            return query
+        query = Query(_DEFAULT_FIELDS if fields is None else fields)
+        if varno is not None:
+            query.varno(varno)
+        return query
+
+    def _read_odb(self, filename, query, chunk_size):
         """Read the database and generate a numpy array"""
         logging.info("Extracting data from odb file")
-        rows = []
-        sql_command = f"SELECT {','.join(fields.keys())} FROM <odb>"
-        if varno is not None:
-            sql_command += f" WHERE varno={varno}"
-        with Reader(filename, sql_command) as odb_reader:
-            for row in odb_reader:
-                rows.append(tuple(row))
-        logging.info("Generating numpy array")
-        return np.array(rows, dtype=self._build_dtype(fields))
+        data = np.empty(chunk_size, dtype=self._build_dtype(query.fields))
+        count = 0
+        for chunk in self.iter_chunks(filename, chunk_size=chunk_size, query=query):
+            if count + len(chunk) > len(data):
+                # growing by half keeps the copies to a fraction of the final size
+                data.resize(max(count + len(chunk), len(data) * 3 // 2), refcheck=False)
+            data[count:count + len(chunk)] = chunk
+            count += len(chunk)
+        logging.info("Read %d rows", count)
+        data.resize(count, refcheck=False)
+        return data
@@ -0,0 +1,145 @@
+"""Builder for ODB SQL queries with field projection and row predicates"""
+
+from omfg.constants import Region, Subtype
+
+# the numpy types of the fields used by omfg, for projections given by name
+FIELD_TYPES = {
+    "lat@hdr": "f8",
+    "lon@hdr": "f8",
+    "report_status@hdr": "i4",
+    "an_depar@body": "f8",
+    "corvalue@body": "f8",
+    "fg_depar@body": "f8",
+    "obsvalue@body": "f8",
+    "ops_obstype@hdr": "i4",
+    "vertco_reference_1@body": "f8",
+    "vertco_reference_2@body": "f8",
+    "vertco_type@body": "i4",
+    "varno@body": "i4"
+}
+
+
+class Query:
+    """
+    Builds the SELECT ... WHERE clause run against an ODB2 file, so rows
+    and columns that are not needed are never extracted.  The predicate
+    methods return the query so they can be chained, and every predicate
+    is ANDed together.
+
+    >>> Query(["lat@hdr", "lon@hdr", "obsvalue@body"]).varno(2).vertco_range(50000, 100000)
+    """
+    def __init__(self, fields=None):
+        self._fields = None
+        self._predicates = []
+        self.select(FIELD_TYPES if fields is None else fields)
+
+    @property
+    def fields(self):
+        """The projection as a dict of field name to numpy type"""
+        return dict(self._fields)
+
+    @property
+    def sql(self):
+        """The ODB SQL command"""
+        sql_command = f"SELECT {','.join(self._fields.keys())} FROM <odb>"
+        if self._predicates:
+            sql_command += f" WHERE {' AND '.join(self._predicates)}"
+        return sql_command
+
+    def __str__(self):
+        return self.sql
+
+    def select(self, fields):
+        """
+        Set the projection, either a dict of field name to numpy type or a
+        list of field names known to FIELD_TYPES
+        """
+        if isinstance(fields, dict):
+            self._fields = dict(fields)
+        else:
+            try:
+                self._fields = {name: FIELD_TYPES[name] for name in fields}
+            except KeyError as err:
+                raise ValueError(f"Unknown type for field {err}, use a dict of field types")
+        return self
+
+    def varno(self, *varnos):
+        """Only select the given varnos"""
+        return self._add_in("varno@body", varnos)
+
+    def vertco_type(self, *vertco_types):
+        """Only select the given vertco types"""
+        return self._add_in("vertco_type@body", vertco_types)
+
+    def vertco_range(self, vertco_min, vertco_max):
+        """Only select vertco_reference_1 values within [vertco_min, vertco_max]"""
+        return self._add_range("vertco_reference_1@body", vertco_min, vertco_max)
+
+    def obstype(self, *obstypes):
+        """Only select the given ops_obstype codes"""
+        return self._add_in("ops_obstype@hdr", obstypes)
+
+    def report_status(self, *statuses):
+        """Only select the given report statuses"""
+        return self._add_in("report_status@hdr", statuses)
+
+    def bbox(self, lat_min, lat_max, lon_min, lon_max):
+        """
+        Only select observations inside a lat/lon box.  A box whose lon_min
+        is greater than its lon_max crosses the dateline.
+        """
+        self._add_range("lat@hdr", lat_min, lat_max)
+        lon_min, lon_max = _format_number(lon_min), _format_number(lon_max)
+        if float(lon_min) <= float(lon_max):
+            return self._add_range("lon@hdr", lon_min, lon_max)
+        self._predicates.append(f"(lon@hdr >= {lon_min} OR lon@hdr <= {lon_max})")
+        return self
+
+    @staticmethod
+    def from_config(config):
+        """
+        Build the query for a chart config, projecting only the fields the
+        chart uses and pushing its varno, obs group and vertco selection
+        (plus the optional report_status and bbox or region keys) into the SQL.
+        """
+        column = config["column"]
+        query = Query(["lat@hdr", "lon@hdr", column, "vertco_type@body", "vertco_reference_1@body"])
+        query.varno(config["varno"])
+        if config.get("obs_group") is not None:
+            obstype = Subtype.get_code(config["obs_group"])
+            if obstype is None:
+                raise ValueError(f"Unknown obs group: {config['obs_group']}")
+            query.obstype(obstype)
+        if config.get("vertco_type") is not None:
+            query.vertco_type(config["vertco_type"])
+        if config.get("vertco") is not None:
+            query.vertco_range(*config["vertco"].split(","))
+        if config.get("report_status") is not None:
+            query.report_status(*str(config["report_status"]).split(","))
+        bbox = Region.get_config_bbox(config)
+        if bbox is not None:
+            query.bbox(*bbox)
+        return query
+
+    def _add_in(self, field, values):
+        """Add an equality or IN predicate on integer codes"""
+        values = [str(int(value)) for value in values]
+        if not values:
+            raise ValueError(f"No values given for {field}")
+        if len(values) == 1:
+            self._predicates.append(f"{field} = {values[0]}")
+        else:
+            self._predicates.append(f"{field} IN ({','.join(values)})")
+        return self
+
+    def _add_range(self, field, value_min, value_max):
+        """Add an inclusive range predicate"""
+        self._predicates.append(
+            f"{field} >= {_format_number(value_min)} AND {field} <= {_format_number(value_max)}"
+        )
+        return self
+
+
+def _format_number(value):
+    """Format a number for SQL, rejecting anything that is not numeric"""
+    return repr(float(value))
@@ -23,9 +23,18 @@ setup(
     packages=find_packages(),
     python_requires=">=3.6",
     include_package_data=True,
+    package_data={
+        "omfg.chart": ["cartopy/geometry.npz", "cartopy/shapefiles/natural_earth/*/*"]
+    },
     entry_points={
         "console_scripts": [
-            "omfg-generate = omfg.cli.generator:main"
+            "omfg-generate = omfg.cli.generator:main",
+            "omfg-client = omfg.cli.client:main",
+            "omfg-ingest = omfg.cli.ingest:main",
+            "omfg-serve = omfg.cli.server:main",
+            "omfg-stats = omfg.cli.stats:main",
+            "omfg-split = omfg.cli.splitter:main",
+            "omfg-geometry = omfg.cli.geometry:main"
         ]
     },
     project_urls={
@@ -0,0 +1,39 @@
+"""Tests for the per-cycle partition store"""
+
+import numpy as np
+from omfg.store import CycleStore
+from omfg.wrappers.odb import ODB
+from omfg.wrappers.query import FIELD_TYPES
+
+
+def make_rows(rows):
+    """Make rows of one partition (aircraft temperature at 500 hPa)"""
+    data = np.zeros(rows, dtype=ODB._build_dtype(FIELD_TYPES))
+    data["ops_obstype@hdr"] = 10100
+    data["varno@body"] = 2
+    data["vertco_type@body"] = 1
+    data["vertco_reference_1@body"] = 50000.0
+    data["obsvalue@body"] = np.arange(rows, dtype=np.float64)
+    return data
+
+
+def test_switching_layout_replaces_partition(tmp_path):
+    """A partition rewritten in the other layout is read from the new write"""
+    columnar = CycleStore(tmp_path, "2020010100", columnar=True)
+    single = CycleStore(tmp_path, "2020010100")
+    columnar.write("aircraft", 2, make_rows(1000))
+    single.write("aircraft", 2, make_rows(5000))
+    assert len(single.load("aircraft", 2)) == 5000
+    assert not single.get_columnar_path("aircraft", 2).exists()
+    assert not list(single.path.glob(".aircraft_2.*"))
+    assert single.load_stats("aircraft", 2, compute=False) is not None
+
+    columnar.write("aircraft", 2, make_rows(3000))
+    assert len(columnar.load("aircraft", 2)) == 3000
+    for filepath in (
+            columnar.get_partition_path("aircraft", 2),
+            columnar.get_index_path("aircraft", 2),
+            columnar.get_cells_path("aircraft", 2)
+    ):
+        assert not filepath.exists()
+    assert columnar.load_stats("aircraft", 2, compute=False) is not None
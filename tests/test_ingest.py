@@ -0,0 +1,65 @@
+"""Tests for the incremental ingest into a per-cycle store"""
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from omfg.store import CycleStore, ingest as ingest_module
+from omfg.wrappers.odb import ODB
+from omfg.wrappers.query import FIELD_TYPES
+
+
+class NpyODB(ODB):
+    """ODB stand-in reading a structured array saved with np.save, so no ODB API is needed"""
+    def __init__(self, filename, chunk_size=None, query=None):
+        self._data = np.load(filename)
+        self._varnos = None
+        self._varno_offsets = None
+
+
+def write_rows(path, rows, seed):
+    """Write rows of one partition (aircraft temperature at 500 hPa) as a fake ODB file"""
+    rng = np.random.default_rng(seed)
+    data = np.zeros(rows, dtype=ODB._build_dtype(FIELD_TYPES))
+    data["ops_obstype@hdr"] = 10100
+    data["varno@body"] = 2
+    data["vertco_type@body"] = 1
+    data["vertco_reference_1@body"] = 50000.0
+    data["lat@hdr"] = rng.uniform(-90, 90, rows)
+    data["lon@hdr"] = rng.uniform(-180, 180, rows)
+    data["obsvalue@body"] = rng.normal(250, 20, rows)
+    with open(path, "wb") as fh_out:
+        np.save(fh_out, data)
+
+
+def count_rows(store):
+    """Count the rows of every partition in the store"""
+    return {
+        (obs_group, varno): len(store.load(obs_group, varno))
+        for obs_group, varno in store.partitions
+    }
+
+
+def test_failed_changed_file_keeps_shared_partition(tmp_path, monkeypatch):
+    """A changed file that fails to read must not shrink the partitions it shares"""
+    monkeypatch.setattr(ingest_module, "ODB", NpyODB)
+    monkeypatch.setattr(ingest_module, "ProcessPoolExecutor", ThreadPoolExecutor)
+    file_a, file_b = tmp_path / "a.npy", tmp_path / "b.npy"
+    write_rows(file_a, 4000, seed=1)
+    write_rows(file_b, 3000, seed=2)
+    store = CycleStore(tmp_path / "store", "2020010100")
+    reports = ingest_module.ingest_files([file_a, file_b], store, workers=2)
+    assert [report["status"] for report in reports] == ["OK", "OK"]
+    before = count_rows(store)
+    assert sum(before.values()) == 7000
+
+    # both files change, and the new a can not be read
+    write_rows(file_b, 3500, seed=3)
+    file_a.write_bytes(b"not an odb file")
+    reports = ingest_module.ingest_files([file_a, file_b], store, workers=2)
+    assert [report["status"] for report in reports] == ["FAIL", "OK"]
+    assert count_rows(store) == before
+
+    # a is back as recorded, so it is only re-read for the partition b rebuilds
+    write_rows(file_a, 4000, seed=1)
+    reports = ingest_module.ingest_files([file_a, file_b], store, workers=2)
+    assert [report["status"] for report in reports] == ["SKIP", "OK"]
+    assert sum(count_rows(store).values()) == 7500